@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+import sys
+from datetime import datetime, timedelta
+import numpy as np
+from DividendCache import cachedFetcher
+from DividendFetch import fetchPrices
+from DividendIndicators import indicatorFields, indicatorSeries, screenIndicators
+from DividendMetrics import startRun, finishRun, timeStage
+from DividendResults import writeTable
+from DividendRules import applyRules, ruleConditions, ruleIndicators, ruleSetFor
+from DividendSources import sourceFetcher
+from DividendUniverse import watchStatus
+
+
+# Years of history replayed by default
+backtestYears = 5
+
+# Trading days ahead for the forward return after each transition
+returnHorizons = (5, 20, 60)
+
+transitionHeader = (['Date', 'Ticker', 'From', 'To', 'Close', 'RSI', 'Count'] +
+                    ['Return{0}'.format(horizon) for horizon in returnHorizons])
+
+
+def replayWatchlist(history, rules = None, status = None):
+    # Step the watchlist rules through every day of the history. Returns the
+    # (day, column, from, to) arrays of every status change and the final
+    # status of each ticker. A ticker with no close on a day keeps its status.
+    # The rule conditions are worked out for every day at once, so each day
+    # only moves the status codes, small integers, in a few array steps.
+    rules = rules or ruleSetFor('default')
+    closeMatrix = history['Close']
+    conditions = [np.broadcast_to(condition, closeMatrix.shape)
+                  for condition in ruleConditions(rules, history)]
+    if status is None:
+        status = np.zeros(closeMatrix.shape[1], dtype = np.int8)
+    changes = []
+    for row in range(closeMatrix.shape[0]):
+        newStatus, _ = applyRules(rules, status, [condition[row] for condition in conditions])
+        newStatus = np.where(np.isnan(closeMatrix[row]), status, newStatus)
+        columns = np.flatnonzero(newStatus != status)
+        if len(columns):
+            changes.append((np.full(len(columns), row), columns,
+                            status[columns], newStatus[columns]))
+        status = newStatus
+
+    if not changes:
+        empty = np.zeros(0, dtype = int)
+        return (empty, empty, empty, empty), status
+    days, columns, fromStatus, toStatus = [np.concatenate(part) for part in zip(*changes)]
+    return (days, columns, fromStatus, toStatus), status
+
+
+def forwardReturns(closeMatrix, days, columns, horizons = returnHorizons):
+    # Return from the close on the signal day to the close each horizon
+    # later, NaN where the history ends first
+    entryClose = closeMatrix[days, columns]
+    returns = {}
+    for horizon in horizons:
+        exitDays = days + horizon
+        inRange = exitDays < closeMatrix.shape[0]
+        exitClose = np.full(len(days), np.nan)
+        exitClose[inRange] = closeMatrix[exitDays[inRange], columns[inRange]]
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            returns[horizon] = exitClose / entryClose - 1
+    return returns
+
+
+def loadPriceMatrices(tickers, fields = ('Close',), years = backtestYears):
+    # Fetch the history of every ticker and line each price field up by
+    # date, {field : days x tickers}. Gaps inside a ticker's history carry
+    # the last value forward, and a record without a field gives NaN there.
+    import pandas as pd
+
+    endDate = datetime.now()
+    beginDate = endDate - timedelta(days = int(365.25 * years))
+    priceRecords = {}
+    with timeStage('fetch'):
+        for ticker, priceRecord in fetchPrices(tickers, beginDate, endDate,
+                                               fetcher = cachedFetcher(sourceFetcher())):
+            if priceRecord is not None and len(priceRecord):
+                priceRecords[ticker] = priceRecord
+    fetchedTickers = [ticker for ticker in tickers if ticker in priceRecords]
+    if not fetchedTickers:
+        return fetchedTickers, [], dict((field, np.zeros((0, 0))) for field in fields)
+
+    dates = pd.concat([priceRecords[ticker].Close for ticker in fetchedTickers],
+                      axis = 1).sort_index().index
+    priceMatrices = {}
+    for field in fields:
+        fieldFrame = pd.concat([priceRecords[ticker][field] if field in priceRecords[ticker]
+                                else pd.Series(np.nan, index = priceRecords[ticker].index)
+                                for ticker in fetchedTickers], axis = 1).reindex(dates)
+        # ffill(limit_area = 'inside') written out for pandas before 2.2
+        fieldFrame = fieldFrame.ffill().where(fieldFrame.bfill().notna())
+        priceMatrices[field] = fieldFrame.to_numpy(dtype = float)
+    return fetchedTickers, list(dates), priceMatrices
+
+
+def backtestIndicators(rules):
+    # The screen measures plus every indicator the rules read
+    return screenIndicators + [name for name in ruleIndicators({'replay' : rules})
+                               if name not in screenIndicators]
+
+
+def backtest(tickers, dates, priceMatrices, rules = None):
+    # Replay the watchlist over the whole history and return one row per
+    # status change with the forward returns that followed it. priceMatrices
+    # must hold every field the rules' indicators read, as the live screen
+    # loads them, since a missing High or Low would quietly become the close.
+    rules = rules or ruleSetFor('default')
+    names = backtestIndicators(rules)
+    missing = [field for field in indicatorFields(names) if field not in priceMatrices]
+    if missing:
+        raise ValueError('the rules read {0}, which the backtest did not load'.format(
+                ', '.join(missing)))
+    closeMatrix = priceMatrices['Close']
+    with timeStage('indicators'):
+        history = indicatorSeries(priceMatrices, names)
+    with timeStage('replay'):
+        (days, columns, fromStatus, toStatus), _ = replayWatchlist(history, rules)
+        returns = forwardReturns(closeMatrix, days, columns)
+
+    # Build the columns as arrays and zip them into rows only at the end
+    dateNames = np.array([date.strftime('%Y-%m-%d') for date in dates], dtype = object)
+    statusNames = np.array(watchStatus, dtype = object)
+    columnsOut = [dateNames[days], np.array(tickers, dtype = object)[columns],
+                  statusNames[fromStatus], statusNames[toStatus],
+                  np.round(closeMatrix[days, columns], 2),
+                  np.round(history['RSI'][days, columns], 1),
+                  history['Count'][days, columns]]
+    columnsOut.extend([np.round(returns[horizon] * 100, 2) for horizon in returnHorizons])
+    rows = [list(row) for row in zip(*[column.tolist() for column in columnsOut])]
+    return rows
+
+
+def summarize(rows):
+    # Signals and average forward return per status moved into
+    lines = [' {0:<20} {1:>8}'.format('Status', 'Signals') +
+             ''.join(' {0:>9} {1:>6}'.format('Avg' + str(horizon) + 'd', 'Up%')
+                     for horizon in returnHorizons)]
+    for status in watchStatus[1:]:
+        signals = [row for row in rows if row[3] == status]
+        line = ' {0:<20} {1:8d}'.format(status, len(signals))
+        for position in range(len(returnHorizons)):
+            returns = np.array([row[7 + position] for row in signals], dtype = float)
+            returns = returns[~np.isnan(returns)]
+            if len(returns):
+                line += ' {0:8.2f}% {1:5.1f}%'.format(returns.mean(),
+                                                       (returns > 0).mean() * 100)
+            else:
+                line += ' {0:>9} {1:>6}'.format('-', '-')
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    # DividendBacktest.py tickers.csv [years] [transitions.csv] [rule set]
+    from DividendUniverse import loadBadTickers, readTickerList
+
+    csvTickerFile = sys.argv[1] if len(sys.argv) > 1 else 'DividendChampion.csv'
+    years = float(sys.argv[2]) if len(sys.argv) > 2 else backtestYears
+    transitionFile = sys.argv[3] if len(sys.argv) > 3 else 'BacktestTransitions.csv'
+    rules = ruleSetFor(sys.argv[4] if len(sys.argv) > 4 else 'default')
+
+    profiler = startRun()
+    tickers = readTickerList(csvTickerFile, loadBadTickers())
+    tickers, dates, priceMatrices = loadPriceMatrices(
+            tickers, indicatorFields(backtestIndicators(rules)), years)
+    print(' Replaying {0} tickers over {1} days'.format(len(tickers), len(dates)),
+          flush = True)
+    rows = backtest(tickers, dates, priceMatrices, rules)
+    with timeStage('results'):
+        writeTable(transitionFile, transitionHeader, rows)
+    print(summarize(rows))
+    finishRun('DividendBacktest', profiler)
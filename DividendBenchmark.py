@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+import contextlib
+import csv
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+import DividendFetch
+import DividendTickersCCC
+import DividendSources
+import DividendUniverse
+from DividendBacktest import backtest
+from DividendIndicators import buildCloseMatrix, computeIndicators
+from DividendState import screenRecords
+
+
+# Lists the synthetic universe is split into, as for the CCC run
+listFiles = [('DividendChampion.csv', 'ChampionResultCCC.csv',
+              'ChampionWatchlistCCC.csv', 'DividendChampions'),
+             ('DividendContenders.csv', 'ContenderResultCCC.csv',
+              'ContenderWatchlistCCC.csv', 'DividendContenders'),
+             ('DividendChallengers.csv', 'ChallengerResultCCC.csv',
+              'ChallengerWatchlistCCC.csv', 'DividendChallengers')]
+
+
+@contextlib.contextmanager
+def stage(timings, name):
+    # Time one stage and keep the scripts' progress output out of the way
+    startTime = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+    timings[name] = round(time.perf_counter() - startTime, 4)
+
+
+def writeFixtures(tickers):
+    # Split the tickers across three overlapping lists with a few bad and
+    # double dividend tickers and a seeded watchlist, like the real inputs
+    third = len(tickers) // 3
+    tickerLists = [tickers[:third + third // 4],
+                   tickers[third:2 * third + third // 4],
+                   tickers[2 * third:]]
+    for (csvTickerFile, _, csvWatchlistFile, _), tickerList in zip(listFiles, tickerLists):
+        with open(csvTickerFile, 'w', newline = '') as fileOut:
+            csv.writer(fileOut).writerows([[ticker] for ticker in tickerList])
+        with open(csvWatchlistFile, 'w', newline = '') as fileOut:
+            w = csv.writer(fileOut)
+            w.writerow(['Ticker', 'Status'])
+            w.writerows([[ticker, 'Added to watchlist'] for ticker in tickerList[::25]])
+    with open('DividendBadTickers.csv', 'w', newline = '') as fileOut:
+        csv.writer(fileOut).writerows([[ticker] for ticker in tickers[::97]])
+    with open('DoubleDividends.csv', 'w', newline = '') as fileOut:
+        csv.writer(fileOut).writerows([[ticker] for ticker in tickers[::11]])
+    return
+
+
+def benchmark(tickerCount, days, latency = 0.0, chartCount = 5):
+    # Run every stage of the screen against synthetic prices and return the
+    # seconds spent in each
+    tickers = ['S{0:05d}'.format(i) for i in range(tickerCount)]
+    endDate = datetime.now()
+    beginDate = endDate - timedelta(days = 365)
+    stub = DividendSources.stubFetcher(latency, days = days)
+    timings = {}
+
+    workDir = os.getcwd()
+    sourceSetting = DividendSources.dataSource
+    with tempfile.TemporaryDirectory() as benchDir:
+        os.chdir(benchDir)
+        try:
+            writeFixtures(tickers)
+
+            with stage(timings, 'loadLists'):
+                badTickers = DividendUniverse.loadBadTickers()
+                ddTickers = DividendUniverse.loadDoubleDividends()
+                tickerLists = [DividendUniverse.readTickerList(fileSet[0], badTickers)
+                               for fileSet in listFiles]
+
+            allTickers = sorted(set(ticker for tickerList in tickerLists
+                                    for ticker in tickerList))
+            with stage(timings, 'fetch'):
+                priceRecords = dict(DividendFetch.fetchPrices(allTickers, beginDate, endDate,
+                                                              fetcher = stub))
+
+            with stage(timings, 'indicators'):
+                computeIndicators(buildCloseMatrix([priceRecords[ticker].Close
+                                                    for ticker in allTickers]))
+
+            # Synthetic histories all end on the same day, so the right
+            # aligned close matrix is also lined up by date
+            with stage(timings, 'backtest'):
+                closeMatrix = buildCloseMatrix([priceRecords[ticker].Close
+                                                for ticker in allTickers])
+                backtest(allTickers, list(priceRecords[allTickers[0]].index),
+                         {'Close' : closeMatrix})
+
+            with stage(timings, 'indicatorState'):
+                screened = screenRecords(allTickers, priceRecords)
+
+            with stage(timings, 'indicatorStateUpdate'):
+                screenRecords(allTickers, priceRecords)
+
+            with stage(timings, 'watchlistAndResults'):
+                for (_, csvResultFile, csvWatchlistFile, descriptor), tickerList in \
+                        zip(listFiles, tickerLists):
+                    DividendTickersCCC.main(tickerList, {}, descriptor, csvResultFile,
+                                            csvWatchlistFile, screened, ddTickers)
+
+            # The whole CCC run end to end through the price cache, with
+            # every module that asks for the data source getting the stub
+            DividendSources.dataSource = 'stub:{0},{1}'.format(latency, days)
+            with stage(timings, 'processFilesColdCache'):
+                DividendTickersCCC.processFiles(listFiles)
+            with stage(timings, 'processFilesWarmCache'):
+                DividendTickersCCC.processFiles(listFiles)
+
+            if chartCount:
+                import DividendGraphs
+                DividendGraphs.loadPyplot(headless = True)
+                with stage(timings, 'charts'):
+                    for ticker in allTickers[:chartCount]:
+                        DividendGraphs.technicalIndicators(ticker)
+                        DividendGraphs.plt.close()
+        finally:
+            DividendSources.dataSource = sourceSetting
+            os.chdir(workDir)
+
+    return {'tickers' : tickerCount, 'days' : days, 'latency' : latency,
+            'charts' : chartCount, 'seconds' : timings}
+
+
+if __name__ == '__main__':
+    # DividendBenchmark.py [100,1000,10000] [days] [output.json]
+    tickerCounts = [int(count) for count in
+                    (sys.argv[1] if len(sys.argv) > 1 else '100,1000').split(',')]
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 250
+    outputFile = sys.argv[3] if len(sys.argv) > 3 else 'DividendBenchmark.json'
+
+    runs = []
+    for tickerCount in tickerCounts:
+        run = benchmark(tickerCount, days)
+        print(' {0} tickers x {1} days:'.format(tickerCount, days))
+        for name, seconds in run['seconds'].items():
+            print('   {0:<24} {1:9.3f}s'.format(name, seconds))
+        runs.append(run)
+
+    with open(outputFile, 'w') as fileOut:
+        json.dump({'date' : datetime.now().isoformat(timespec = 'seconds'),
+                   'python' : platform.python_version(),
+                   'runs' : runs}, fileOut, indent = 2)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+import sqlite3
+from datetime import datetime, timedelta
+from pytz import timezone
+from DividendMetrics import countTicker
+
+
+# Local price store shared by every script
+cacheFile = 'DividendPrices.db'
+# Dividend is the cash paid on each ex-dividend date, 0 on other days,
+# and empty for sources that do not report dividends
+priceColumns = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividend']
+
+# Until the close the bar of the day is still moving, so it is stored but
+# the day is not counted as covered and the next run fetches it again
+marketZone = 'US/Eastern'
+marketClose = (16, 0)
+
+
+def openCache(path = None):
+    # Each caller gets its own connection so worker threads can share a file
+    connection = sqlite3.connect(path or cacheFile, timeout = 30)
+    connection.execute('CREATE TABLE IF NOT EXISTS prices ('
+                       'ticker TEXT NOT NULL, date TEXT NOT NULL, '
+                       'open REAL, high REAL, low REAL, close REAL, volume REAL, '
+                       'dividend REAL, PRIMARY KEY (ticker, date))')
+    # The date range already requested for each ticker, so a short history
+    # is not mistaken for a missing one and fetched again
+    connection.execute('CREATE TABLE IF NOT EXISTS coverage ('
+                       'ticker TEXT PRIMARY KEY, beginDate TEXT NOT NULL, '
+                       'endDate TEXT NOT NULL)')
+
+    # Stores made before dividends were kept get the column, and every bar
+    # is fetched again once so the dividends are filled in
+    columns = [row[1] for row in connection.execute('PRAGMA table_info(prices)')]
+    if 'dividend' not in columns:
+        try:
+            connection.execute('ALTER TABLE prices ADD COLUMN dividend REAL')
+            connection.execute('DELETE FROM coverage')
+            connection.commit()
+        except sqlite3.OperationalError:
+            # another connection added it first
+            connection.rollback()
+    return connection
+
+
+def storePrices(connection, ticker, priceRecord):
+    # Merge a downloaded DataFrame into the store, newer bars win
+    rows = []
+    for date, record in priceRecord.iterrows():
+        row = [ticker, date.strftime('%Y-%m-%d')]
+        for column in priceColumns:
+            value = record.get(column)
+            row.append(None if value is None or value != value else float(value))
+        rows.append(row)
+    connection.executemany('INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                           rows)
+    return len(rows)
+
+
+def readPrices(connection, ticker, beginDate, endDate):
+    # Return the stored bars for a ticker as a DataFrame indexed by date,
+    # oldest first, with the same columns the data sources return
+    import pandas as pd
+
+    rows = connection.execute('SELECT date, open, high, low, close, volume, dividend '
+                              'FROM prices WHERE ticker = ? AND date BETWEEN ? AND ? '
+                              'ORDER BY date',
+                              (ticker, beginDate.strftime('%Y-%m-%d'),
+                               endDate.strftime('%Y-%m-%d'))).fetchall()
+    priceRecord = pd.DataFrame([row[1:] for row in rows], columns = priceColumns,
+                               index = pd.to_datetime([row[0] for row in rows]),
+                               dtype = float)
+    priceRecord.index.name = 'Date'
+    return priceRecord
+
+
+def missingRanges(coverage, beginDate, endDate):
+    # Work out which date ranges still need to be downloaded
+    if coverage is None:
+        return [(beginDate, endDate)]
+    coveredBegin = datetime.strptime(coverage[0], '%Y-%m-%d')
+    coveredEnd = datetime.strptime(coverage[1], '%Y-%m-%d')
+    ranges = []
+    if beginDate.date() < coveredBegin.date():
+        ranges.append((beginDate, coveredBegin - timedelta(days = 1)))
+
+    # Only look for new bars once a weekday has passed since the last top-up
+    nextBar = coveredEnd + timedelta(days = 1)
+    while nextBar.weekday() > 4:
+        nextBar += timedelta(days = 1)
+    if nextBar.date() <= endDate.date():
+        ranges.append((nextBar, endDate))
+    return ranges
+
+
+def readCoverage(connection, ticker):
+    return connection.execute('SELECT beginDate, endDate FROM coverage '
+                              'WHERE ticker = ?', (ticker,)).fetchone()
+
+
+def settledDate(endDate):
+    # The last day up to endDate whose bar is final
+    now = datetime.now(timezone(marketZone))
+    lastSettled = now.date()
+    if (now.hour, now.minute) < marketClose:
+        lastSettled -= timedelta(days = 1)
+    return min(endDate.date(), lastSettled)
+
+
+def extendCoverage(connection, ticker, coverage, beginDate, endDate):
+    # Record that every final bar between beginDate and endDate is now stored
+    settled = settledDate(endDate).strftime('%Y-%m-%d')
+    if coverage is None:
+        newBegin, newEnd = beginDate.strftime('%Y-%m-%d'), settled
+    else:
+        newBegin = min(beginDate.strftime('%Y-%m-%d'), coverage[0])
+        newEnd = max(settled, coverage[1])
+    connection.execute('INSERT OR REPLACE INTO coverage VALUES (?, ?, ?)',
+                       (ticker, newBegin, newEnd))
+    return
+
+
+def cachedFetcher(fetcher, path = None):
+    # Wrap a fetcher so it reads from the store and only downloads the
+    # dates that are not there yet. The wrapper keeps the fetcher signature
+    # so it can be handed straight to fetchPrices. Sources that already
+    # read from local files, such as a price matrix, are not copied in.
+    if getattr(fetcher, 'skipCache', False):
+        return fetcher
+
+    def fetch(ticker, beginDate, endDate):
+        connection = openCache(path)
+        try:
+            coverage = readCoverage(connection, ticker)
+            fetchRanges = missingRanges(coverage, beginDate, endDate)
+            countTicker(ticker, 'cacheMiss' if fetchRanges else 'cacheHit')
+            for rangeBegin, rangeEnd in fetchRanges:
+                try:
+                    countTicker(ticker, 'rowsDownloaded',
+                                storePrices(connection, ticker,
+                                            fetcher(ticker, rangeBegin, rangeEnd)))
+                except Exception:
+                    # A failed top-up still leaves usable history behind,
+                    # but a ticker with nothing stored is a real failure
+                    if coverage is None:
+                        raise
+                    print(' {0} top-up failed, using cached prices'.format(ticker),
+                          flush = True)
+                    break
+            else:
+                extendCoverage(connection, ticker, coverage, beginDate, endDate)
+            connection.commit()
+            return readPrices(connection, ticker, beginDate, endDate)
+        finally:
+            connection.close()
+
+    def bulkFetch(tickers, beginDate, endDate):
+        # Tickers missing the same date ranges are topped up together, one
+        # bulk request per range. Tickers with nothing stored that the
+        # source leaves out are left for the one ticker at a time path.
+        connection = openCache(path)
+        try:
+            coverages = {}
+            groups = {}
+            for ticker in tickers:
+                coverages[ticker] = readCoverage(connection, ticker)
+                fetchRanges = tuple(missingRanges(coverages[ticker], beginDate, endDate))
+                countTicker(ticker, 'cacheMiss' if fetchRanges else 'cacheHit')
+                groups.setdefault(fetchRanges, []).append(ticker)
+
+            priceRecords = {}
+            for fetchRanges, group in groups.items():
+                complete = set(group)
+                for rangeBegin, rangeEnd in fetchRanges:
+                    try:
+                        downloaded = fetcher.bulkFetch(group, rangeBegin, rangeEnd)
+                    except Exception as err:
+                        print(' bulk fetch of {0} tickers failed: {1}'.format(len(group), err),
+                              flush = True)
+                        downloaded = {}
+                    for ticker in group:
+                        if ticker in downloaded:
+                            countTicker(ticker, 'rowsDownloaded',
+                                        storePrices(connection, ticker, downloaded[ticker]))
+                        else:
+                            complete.discard(ticker)
+
+                for ticker in group:
+                    if ticker in complete:
+                        extendCoverage(connection, ticker, coverages[ticker],
+                                       beginDate, endDate)
+                    elif coverages[ticker] is None:
+                        continue
+                    else:
+                        print(' {0} top-up failed, using cached prices'.format(ticker),
+                              flush = True)
+                    priceRecords[ticker] = readPrices(connection, ticker, beginDate, endDate)
+            connection.commit()
+            return priceRecords
+        finally:
+            connection.close()
+
+    if hasattr(fetcher, 'bulkFetch'):
+        fetch.bulkFetch = bulkFetch
+    return fetch
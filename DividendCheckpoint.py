@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import json
+import os
+from datetime import date
+
+
+# Tickers are fetched and scored in batches of this size, and the
+# checkpoint is saved after each batch
+checkpointEvery = 50
+
+# Extra passes over the tickers that failed, once everything else is done
+failureSweeps = 1
+
+
+# A checkpoint holds the progress of one script's run for the day:
+#   script     the script it belongs to, which also names the file
+#   runDay     the day of the run, an older checkpoint is not resumed
+#   screened   (close, bollPct, lowerBound, RSI, ROC, count) per finished ticker
+#   failed     tickers left out after every retry
+#   lists      watchlist of each list already written, keyed by descriptor
+
+
+def checkpointPath(scriptName):
+    return scriptName + '.checkpoint.json'
+
+
+def loadCheckpoint(scriptName):
+    # Pick up today's checkpoint for the script, or start a new one
+    path = checkpointPath(scriptName)
+    if os.path.exists(path):
+        try:
+            with open(path, 'r') as fileIn:
+                checkpoint = json.load(fileIn)
+        except ValueError:
+            checkpoint = {}
+        if checkpoint.get('runDay') == date.today().isoformat():
+            checkpoint['screened'] = dict((ticker, tuple(row)) for ticker, row in
+                                          checkpoint['screened'].items())
+            print(' Resuming {0}: {1} tickers and {2} lists already done'.format(
+                    scriptName, len(checkpoint['screened']), len(checkpoint['lists'])),
+                  flush = True)
+            return checkpoint
+    return {'script' : scriptName, 'runDay' : date.today().isoformat(),
+            'screened' : {}, 'failed' : [], 'lists' : {}}
+
+
+def saveCheckpoint(checkpoint):
+    # Replace the file in one step so an interrupted save leaves the last
+    # good checkpoint behind
+    path = checkpointPath(checkpoint['script'])
+    with open(path + '.tmp', 'w') as fileOut:
+        json.dump(checkpoint, fileOut)
+    os.replace(path + '.tmp', path)
+    return
+
+
+def clearCheckpoint(checkpoint):
+    # The run finished, so the next one starts from scratch
+    path = checkpointPath(checkpoint['script'])
+    if os.path.exists(path):
+        os.remove(path)
+    return
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+
+import json
+import os
+import sys
+import threading
+import traceback
+from datetime import datetime, timedelta
+from wsgiref.simple_server import make_server
+from pytz import timezone
+from DividendCache import (cachedFetcher, openCache, storePrices, readCoverage, extendCoverage,
+                           marketZone, marketClose)
+from DividendCheckpoint import loadCheckpoint, saveCheckpoint
+from DividendFetch import fetchPrices
+from DividendMetrics import timeStage
+from DividendResults import resultColumns, resultRow
+from DividendSources import sourceFetcher
+from DividendState import openStateStore, loadStates, saveStates, scoreStates
+from DividendTickersCCC import main, whenIsNow
+from DividendUniverse import (cccFileSets, watchStatus, badTickerFile, doubleDividendFile,
+                              loadBadTickers, loadDoubleDividends, readTickerList,
+                              unionTickers, loadWatchlist)
+
+
+# A resident version of DividendTickersCCC. The ticker lists, a year of
+# prices and the indicator state of every ticker stay in memory between
+# refreshes. A refresh asks the source only for the bars since each
+# ticker's newest one, rescores only the tickers whose bars changed and
+# rewrites only the lists holding one. The watchlist and results are
+# served as JSON over local HTTP:
+#
+#     GET  /status                  refresh times and counts
+#     GET  /watchlist[/descriptor]  {descriptor : {ticker : status}}
+#     GET  /results[/descriptor]    {descriptor : {columns, rows}}
+#     POST /refresh                 refresh now
+#
+# Every refresh of a day runs the watchlist rules from the watchlists as
+# they stood when the day began, kept in the DividendDaemon checkpoint, so
+# refreshing all day gives the same watchlist as one run after the close.
+# Run it instead of the cron job, not beside it.
+daemonHost = '127.0.0.1'
+daemonPort = 8765
+
+# Refresh every refreshMinutes while the market is open, 0 for only after
+# the close, and closeDelay minutes after the close for the final bars.
+# The market zone and close are those of DividendCache.
+marketOpen = (9, 30)
+refreshMinutes = 15
+closeDelay = 30
+
+service = {'fileSets' : cccFileSets, 'listTimes' : None, 'tickerLists' : [],
+           'ddTickers' : frozenset(), 'priceRecords' : {}, 'states' : {},
+           'screened' : {}, 'failed' : [], 'checkpoint' : None,
+           'watch' : {}, 'results' : {}, 'lastRefresh' : None, 'refreshSeconds' : None,
+           'nextRefresh' : None, 'changed' : 0, 'refreshes' : 0, 'error' : None}
+serviceLock = threading.Lock()
+refreshNow = threading.Event()
+
+
+def nextRefresh(now):
+    # The first refresh time after now, skipping weekends
+    zone = timezone(marketZone)
+    local = now.astimezone(zone)
+    for dayOffset in range(8):
+        day = (local + timedelta(days = dayOffset)).date()
+        if day.weekday() > 4:
+            continue
+        opens = zone.localize(datetime(day.year, day.month, day.day, *marketOpen))
+        closes = zone.localize(datetime(day.year, day.month, day.day, *marketClose))
+        settled = closes + timedelta(minutes = closeDelay)
+        if refreshMinutes and local < opens:
+            return opens
+        if refreshMinutes and local < closes:
+            return min(local + timedelta(minutes = refreshMinutes), settled)
+        if local < settled:
+            return settled
+    return local + timedelta(days = 1)
+
+
+def loadUniverse():
+    # Read the ticker lists again when any of their files changed.
+    # Returns True when they did.
+    fileSets = service['fileSets']
+    paths = [fileSet[0] for fileSet in fileSets] + [badTickerFile, doubleDividendFile]
+    listTimes = [os.path.getmtime(path) if os.path.exists(path) else None for path in paths]
+    if listTimes == service['listTimes']:
+        return False
+    with timeStage('loadLists'):
+        badTickers = loadBadTickers()
+        tickerLists = [readTickerList(fileSet[0], badTickers) for fileSet in fileSets]
+        ddTickers = loadDoubleDividends()
+    allTickers = set(unionTickers(tickerLists))
+    for held in (service['priceRecords'], service['states'], service['screened']):
+        for ticker in [ticker for ticker in held if ticker not in allTickers]:
+            del held[ticker]
+    service['tickerLists'] = tickerLists
+    service['ddTickers'] = ddTickers
+    service['listTimes'] = listTimes
+    return True
+
+
+def refreshPrices(tickers):
+    # Bring the price records in memory up to now. Tickers already held ask
+    # the source only for the bars since the oldest newest bar among them,
+    # in bulk where the source allows, and the new bars go into the price
+    # cache. Tickers not held yet load a year through the price cache.
+    # Returns the tickers whose bars changed and the tickers that failed.
+    priceRecords = service['priceRecords']
+    endDate = datetime.now()
+    beginDate = endDate - timedelta(days = 365)
+    changed = []
+    failed = []
+
+    newTickers = [ticker for ticker in tickers if ticker not in priceRecords]
+    if newTickers:
+        for ticker, priceRecord in fetchPrices(newTickers, beginDate, endDate,
+                                               fetcher = cachedFetcher(sourceFetcher())):
+            if priceRecord is None or not len(priceRecord):
+                failed.append(ticker)
+            else:
+                priceRecords[ticker] = priceRecord
+                changed.append(ticker)
+
+    heldTickers = [ticker for ticker in tickers if ticker in priceRecords
+                   and ticker not in changed]
+    if heldTickers:
+        tailBegin = min(priceRecords[ticker].index[-1] for ticker in heldTickers).to_pydatetime()
+        connection = openCache()
+        try:
+            for ticker, tail in fetchPrices(heldTickers, tailBegin, endDate,
+                                            fetcher = sourceFetcher()):
+                if tail is None:
+                    # keep serving the bars already held
+                    failed.append(ticker)
+                    continue
+                priceRecord = priceRecords[ticker]
+                tail = tail[tail.index >= tailBegin].reindex(columns = priceRecord.columns)
+                merged = tail.combine_first(priceRecord)[priceRecord.columns]
+                merged = merged[merged.index >= beginDate]
+                if not merged.equals(priceRecord):
+                    priceRecords[ticker] = merged
+                    changed.append(ticker)
+                    storePrices(connection, ticker, tail)
+                    extendCoverage(connection, ticker, readCoverage(connection, ticker),
+                                   tailBegin, endDate)
+            connection.commit()
+        finally:
+            connection.close()
+    return changed, failed
+
+
+def startDay():
+    # The watchlists as they stood when today began, read from the files
+    # on the first refresh of the day and kept in the checkpoint so a
+    # restart later in the day does not step them twice.
+    # Returns True when a new day started.
+    checkpoint = service['checkpoint']
+    if checkpoint is not None and checkpoint['runDay'] == datetime.now().date().isoformat():
+        return False
+    checkpoint = loadCheckpoint('DividendDaemon')
+    for csvTickerFile, csvResultFile, csvWatchlistFile, descriptor in service['fileSets']:
+        if descriptor not in checkpoint['lists']:
+            checkpoint['lists'][descriptor] = loadWatchlist(csvWatchlistFile)
+    saveCheckpoint(checkpoint)
+    service['checkpoint'] = checkpoint
+    return True
+
+
+def refresh():
+    # Fetch what is new, rescore what changed and rewrite the lists it
+    # touches, then publish the new watchlists and results
+    startTime = datetime.now()
+    rewriteAll = loadUniverse()
+    rewriteAll = startDay() or rewriteAll or not service['results']
+    tickerLists = service['tickerLists']
+    allTickers = unionTickers(tickerLists)
+
+    with timeStage('fetch'):
+        changed, failed = refreshPrices(allTickers)
+    with timeStage('indicators'):
+        states = service['states']
+        unknown = [ticker for ticker in changed if ticker not in states]
+        if unknown:
+            connection = openStateStore()
+            try:
+                states.update(loadStates(connection, unknown))
+            finally:
+                connection.close()
+        screened = dict(service['screened'])
+        screened.update(scoreStates(changed, service['priceRecords'], states))
+    with timeStage('saveState'):
+        connection = openStateStore()
+        try:
+            saveStates(connection, dict((ticker, states[ticker]) for ticker in changed))
+        finally:
+            connection.close()
+
+    changedSet = set(changed)
+    watch = dict(service['watch'])
+    results = dict(service['results'])
+    for fileSet, tickerList in zip(service['fileSets'], tickerLists):
+        csvTickerFile, csvResultFile, csvWatchlistFile, descriptor = fileSet
+        if not rewriteAll and not changedSet.intersection(tickerList):
+            continue
+        print(' ** Writing {0} at'.format(descriptor), whenIsNow(), ' **')
+        listWatch = dict(service['checkpoint']['lists'][descriptor])
+        with timeStage('watchlistAndResults'):
+            main(tickerList, listWatch, descriptor, csvResultFile, csvWatchlistFile,
+                 screened, service['ddTickers'])
+        watch[descriptor] = listWatch
+        results[descriptor] = [resultRow(ticker, screened[ticker])
+                               for ticker in tickerList if ticker in screened]
+
+    with serviceLock:
+        service.update({'screened' : screened, 'watch' : watch, 'results' : results,
+                        'failed' : failed, 'changed' : len(changed),
+                        'lastRefresh' : startTime.isoformat(timespec = 'seconds'),
+                        'refreshSeconds' : round((datetime.now() - startTime).total_seconds(), 2),
+                        'refreshes' : service['refreshes'] + 1, 'error' : None})
+    print(' Refreshed {0} tickers, {1} changed, {2} failed at'.format(
+            len(allTickers), len(changed), len(failed)), whenIsNow(), flush = True)
+    return
+
+
+def refreshLoop(stopping):
+    # Refresh now, then on the market schedule or when asked
+    while not stopping.is_set():
+        try:
+            refresh()
+        except Exception:
+            # keep serving the last good results until the next refresh
+            traceback.print_exc()
+            with serviceLock:
+                service['error'] = traceback.format_exc(limit = 1).strip().splitlines()[-1]
+        wake = nextRefresh(datetime.now(timezone(marketZone)))
+        with serviceLock:
+            service['nextRefresh'] = wake.isoformat(timespec = 'seconds')
+        refreshNow.wait(max((wake - datetime.now(timezone(marketZone))).total_seconds(), 0))
+        refreshNow.clear()
+    return
+
+
+def jsonValue(value):
+    # NaN is not JSON, send null instead
+    return None if isinstance(value, float) and value != value else value
+
+
+def application(environ, startResponse):
+    # The HTTP endpoint, a plain WSGI function
+    path = environ.get('PATH_INFO', '/').strip('/').split('/')
+    method = environ['REQUEST_METHOD']
+    status = '200 OK'
+    with serviceLock:
+        descriptors = [path[1]] if len(path) > 1 else list(service['watch'])
+        if method == 'POST' and path == ['refresh']:
+            refreshNow.set()
+            body = {'refresh' : 'queued'}
+        elif method != 'GET':
+            status, body = '405 Method Not Allowed', {'error' : method + ' not allowed'}
+        elif path[0] in ('', 'status'):
+            body = dict((key, service[key]) for key in
+                        ('lastRefresh', 'refreshSeconds', 'nextRefresh', 'changed',
+                         'failed', 'refreshes', 'error'))
+            body['runDay'] = service['checkpoint'] and service['checkpoint']['runDay']
+            body['tickers'] = len(service['priceRecords'])
+        elif path[0] in ('watchlist', 'results') and all(descriptor in service['watch']
+                                                          for descriptor in descriptors):
+            if path[0] == 'watchlist':
+                body = dict((descriptor, dict((ticker, watchStatus[code]) for ticker, code
+                                              in service['watch'][descriptor].items()))
+                            for descriptor in descriptors)
+            else:
+                body = dict((descriptor, {'columns' : resultColumns(),
+                                          'rows' : [[jsonValue(value) for value in row]
+                                                    for row in service['results'][descriptor]]})
+                            for descriptor in descriptors)
+        else:
+            status, body = '404 Not Found', {'error' : 'no such path ' + environ.get('PATH_INFO', '')}
+    payload = json.dumps(body).encode('utf-8')
+    startResponse(status, [('Content-Type', 'application/json'),
+                           ('Content-Length', str(len(payload)))])
+    return [payload]
+
+
+if __name__ == '__main__':
+    # DividendDaemon.py [port] [minutes between intraday refreshes, 0 for none]
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else daemonPort
+    if len(sys.argv) > 2:
+        refreshMinutes = int(sys.argv[2])
+
+    print('***** Beginning Dividend daemon at', whenIsNow(), ' *****')
+    stopping = threading.Event()
+    refresher = threading.Thread(target = refreshLoop, args = (stopping,), daemon = True)
+    refresher.start()
+    server = make_server(daemonHost, port, application)
+    print(' Serving on http://{0}:{1}/'.format(daemonHost, port), flush = True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopping.set()
+        refreshNow.set()
+        server.server_close()
+    print('***** Ending Dividend daemon at', whenIsNow(), ' *****')
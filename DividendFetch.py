@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+import itertools
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeout
+from datetime import datetime, timedelta
+from DividendCheckpoint import checkpointEvery, failureSweeps
+from DividendMetrics import countTicker, setTicker, timeStage
+from DividendSources import sourceFetcher, stubFetcher
+
+
+# Fetch settings, each can be overridden per call
+maxWorkers = 8
+fetchTimeout = 30.0
+fetchRetries = 3
+retryBackoff = 1.0
+# Symbols per request for sources that can fetch many at once
+bulkSize = 50
+
+
+def fetchChunks(tickers, beginDate, endDate, bulkFetch, workers, timeout, missing):
+    # Ask a bulk source for the tickers a chunk at a time on the pool and
+    # yield each ticker it returns. Tickers the source leaves out, or whose
+    # chunk fails or runs out of time, are added to missing.
+    chunks = [tickers[i:i + bulkSize] for i in range(0, len(tickers), bulkSize)]
+
+    def attemptChunk(chunk):
+        with timeStage('bulkFetch'):
+            return bulkFetch(chunk, beginDate, endDate)
+
+    executor = ThreadPoolExecutor(max_workers = workers)
+    futures = dict((executor.submit(attemptChunk, chunk), chunk) for chunk in chunks)
+    rounds = (len(chunks) + workers - 1) // workers
+    try:
+        for future in as_completed(futures, timeout = timeout * rounds):
+            chunk = futures.pop(future)
+            try:
+                priceRecords = future.result()
+            except Exception as err:
+                print(' bulk fetch of {0} tickers failed: {1}'.format(len(chunk), err),
+                      flush = True)
+                priceRecords = {}
+            for ticker in chunk:
+                if ticker in priceRecords:
+                    countTicker(ticker, 'rows', len(priceRecords[ticker]))
+                    yield ticker, priceRecords[ticker]
+                else:
+                    missing.append(ticker)
+    except FutureTimeout:
+        for chunk in futures.values():
+            missing.extend(chunk)
+    finally:
+        executor.shutdown(wait = False, cancel_futures = True)
+    return
+
+
+def fetchPrices(tickers, beginDate, endDate, fetcher = None,
+                workers = None, timeout = None, retries = None, backoff = None):
+    # Download many tickers at once and yield (ticker, priceRecord) pairs in
+    # the order they finish. A ticker that still fails after every retry is
+    # yielded with a priceRecord of None so the caller decides what to do.
+    fetcher = sourceFetcher() if fetcher is None else fetcher
+    workers = maxWorkers if workers is None else workers
+    timeout = fetchTimeout if timeout is None else timeout
+    retries = fetchRetries if retries is None else retries
+    backoff = retryBackoff if backoff is None else backoff
+
+    # Sources that take many symbols per request go first, and only what
+    # they could not deliver falls through to one request per ticker
+    bulkFetch = getattr(fetcher, 'bulkFetch', None)
+    if bulkFetch is not None and len(tickers) > 1:
+        missing = []
+        for ticker, priceRecord in fetchChunks(list(tickers), beginDate, endDate,
+                                               bulkFetch, workers, timeout, missing):
+            yield ticker, priceRecord
+        tickers = missing
+
+    # Tickers waiting for a slot, as (ready time, ticker, attempt)
+    waiting = [(0.0, ticker, 0) for ticker in tickers]
+    waiting.reverse()
+    # Attempts in progress, attempt number : (ticker, attempt, deadline)
+    running = {}
+    finished = queue.Queue()
+    attemptNumbers = itertools.count()
+
+    def attemptFetch(number, ticker):
+        # Every attempt gets a thread of its own, started the moment its
+        # slot frees up, so its deadline only counts time it really runs.
+        # A request abandoned after timing out keeps only its own thread
+        # busy and its slot goes straight to the next ticker.
+        try:
+            with timeStage('fetch', ticker):
+                priceRecord = fetcher(ticker, beginDate, endDate)
+        except Exception as err:
+            finished.put((number, None, err))
+        else:
+            finished.put((number, priceRecord, None))
+
+    while waiting or running:
+        now = time.monotonic()
+
+        # Fill the free slots with tickers whose backoff has expired
+        readyIndex = len(waiting) - 1
+        while len(running) < workers and readyIndex >= 0:
+            readyTime, ticker, attempt = waiting[readyIndex]
+            if readyTime <= now:
+                del waiting[readyIndex]
+                number = next(attemptNumbers)
+                running[number] = (ticker, attempt, now + timeout)
+                threading.Thread(target = attemptFetch, args = (number, ticker),
+                                 daemon = True).start()
+            readyIndex -= 1
+
+        # Sleep until something finishes, times out or comes off backoff
+        deadlines = [deadline for (_, _, deadline) in running.values()]
+        if len(running) < workers:
+            # Only a free slot makes a backoff expiring worth waking for
+            deadlines.extend([readyTime for (readyTime, _, _) in waiting])
+        waitTime = max(min(deadlines) - now, 0.0) if deadlines else None
+        done = {}
+        if running:
+            try:
+                number, priceRecord, failure = finished.get(timeout = waitTime)
+                done[number] = (priceRecord, failure)
+                while True:
+                    number, priceRecord, failure = finished.get_nowait()
+                    done[number] = (priceRecord, failure)
+            except queue.Empty:
+                pass
+        else:
+            time.sleep(waitTime)
+
+        # Results of attempts already abandoned are dropped here
+        now = time.monotonic()
+        for number in list(running):
+            ticker, attempt, deadline = running[number]
+            if number in done:
+                priceRecord, failure = done[number]
+                if failure is None:
+                    del running[number]
+                    if priceRecord is not None:
+                        countTicker(ticker, 'rows', len(priceRecord))
+                    yield ticker, priceRecord
+                    continue
+            elif deadline <= now:
+                # A stuck request cannot be interrupted, so abandon it
+                failure = 'timed out after {0}s'.format(timeout)
+            else:
+                continue
+
+            del running[number]
+            if attempt < retries:
+                # Exponential backoff before the next attempt
+                countTicker(ticker, 'retries')
+                waiting.insert(0, (now + backoff * 2 ** attempt, ticker,
+                                   attempt + 1))
+            else:
+                print(' {0} fetch failed: {1}'.format(ticker, failure),
+                      flush = True)
+                setTicker(ticker, 'failed', str(failure))
+                yield ticker, None
+    return
+
+
+def retrySweeps(tickers, attempt, leftOut, sweeps = None):
+    # Run attempt over the tickers, then over the ones it could not handle
+    # up to sweeps more times once everything else is done. attempt(pending,
+    # failed) is a generator that adds those tickers to failed, and what it
+    # yields is passed on. Tickers that still fail are added to leftOut.
+    sweeps = failureSweeps if sweeps is None else sweeps
+
+    pending = list(tickers)
+    for sweep in range(sweeps + 1):
+        if not pending:
+            break
+        if sweep:
+            print(' Retrying {0} failed tickers'.format(len(pending)), flush = True)
+        failed = []
+        yield from attempt(pending, failed)
+        pending = failed
+
+    if pending:
+        print(' Left out {0} tickers: {1}'.format(len(pending), ', '.join(pending)))
+    leftOut.extend(pending)
+    return
+
+
+def fetchBatches(tickers, beginDate, endDate, fetcher, leftOut, batchSize = None, sweeps = None):
+    # Fetch the tickers a batch at a time and yield {ticker : priceRecord}
+    # of each batch in ticker order, so a caller can score and checkpoint
+    # it. Failed tickers are retried as in retrySweeps.
+    batchSize = checkpointEvery if batchSize is None else batchSize
+
+    def fetchPass(pending, failed):
+        for start in range(0, len(pending), batchSize):
+            batch = pending[start:start + batchSize]
+
+            # grab the data for the batch at once,
+            # keeping each price record as its download finishes
+            fetchedRecords = {}
+            with timeStage('fetch'):
+                for ticker, priceRecord in fetchPrices(batch, beginDate, endDate,
+                                                       fetcher = fetcher):
+                    if priceRecord is None:
+                        print(ticker + ' failure...')
+                        failed.append(ticker)
+                    else:
+                        fetchedRecords[ticker] = priceRecord
+            yield dict((ticker, fetchedRecords[ticker]) for ticker in batch
+                       if ticker in fetchedRecords)
+
+    return retrySweeps(tickers, fetchPass, leftOut, sweeps)
+
+
+if __name__ == '__main__':
+    # Time a serial run against a concurrent one using the stub source
+    tickerCount = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    tickers = ['T{0:05d}'.format(i) for i in range(tickerCount)]
+    endDate = datetime.now()
+    beginDate = endDate - timedelta(days = 365)
+
+    startTime = time.perf_counter()
+    fetchedCount = sum(1 for _ in fetchPrices(tickers, beginDate, endDate,
+                                              fetcher = stubFetcher(latency),
+                                              workers = 1))
+    serialTime = time.perf_counter() - startTime
+
+    startTime = time.perf_counter()
+    fetchedCount = sum(1 for _ in fetchPrices(tickers, beginDate, endDate,
+                                              fetcher = stubFetcher(latency)))
+    concurrentTime = time.perf_counter() - startTime
+
+    print(' {0} tickers at {1}s latency'.format(fetchedCount, latency))
+    print(' serial     {0:.2f}s'.format(serialTime))
+    print(' {0} workers  {1:.2f}s'.format(maxWorkers, concurrentTime))
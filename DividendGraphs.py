@@ -1,20 +1,62 @@
 #!/usr/bin/env python3
 
-import matplotlib
-from matplotlib import pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
 # import matplotlib.finance as finance
 import sys
+import os
 import datetime
-import pandas_datareader as pdr
+import hashlib
+import importlib.util
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from DividendCache import cachedFetcher
+from DividendSources import sourceFetcher
+from DividendMetrics import startRun, finishRun, timeStage, tickerMetrics, mergeTickers
 # import pandas as pd
 # import numpy as np
 
 
-matplotlib.style.use('seaborn-whitegrid')
+# matplotlib, pyplot and the pdf backend are only imported once a chart
+# is drawn, so a run that fails early or only checks its arguments is quick
+matplotlib = None
+plt = None
+PdfPages = None
 
+# Resolution of each page in batch mode
+pageDpi = 100
 
-def technicalIndicators(ticker):
+# The figure a batch worker keeps redrawing for every ticker
+batchLayout = None
+
+# Where a batch worker reads prices, the matrix the parent process built
+batchFetcher = None
+
+# Registry indicators each chart needs, and any more, such as 'SMA50' or
+# 'EMA26', to draw over the close on the first panel
+chartIndicators = ['bollPct', 'lowerBound', 'upperBound', 'RSI', 'ROC']
+chartOverlays = []
+
+# Report mode keeps every page it draws here, named by a hash of what is on
+# it, and only draws the pages whose hash is not already in the folder
+pageCache = 'DividendPages'
+
+
+def loadPyplot(headless = False):
+    # Batch mode forces the Agg backend before pyplot is imported so no
+    # display is needed and nothing interactive is set up
+    global matplotlib, plt, PdfPages
+    if plt is None:
+        import matplotlib
+        if headless:
+            matplotlib.use('Agg')
+        from matplotlib import pyplot
+        from matplotlib.backends import backend_pdf
+        matplotlib.style.use('seaborn-whitegrid')
+        plt = pyplot
+        PdfPages = backend_pdf.PdfPages
+    return plt
+
+
+def chartData(ticker):
     # Set the date range
     beginDate = datetime.datetime.now() - datetime.timedelta(days = 365)
     endDate = datetime.datetime.now()
@@ -23,7 +65,8 @@ def technicalIndicators(ticker):
     try:
         # price = finance.fetch_historical_yahoo(ticker, beginDate, endDate)
         # price = pdr.get_data_yahoo(ticker, beginDate, endDate)
-        priceRecord = pdr.DataReader(ticker, 'google', beginDate, endDate)
+        fetchPrice = batchFetcher or cachedFetcher(sourceFetcher())
+        priceRecord = fetchPrice(ticker, beginDate, endDate)
     except:
         print('   Ticker failure: ', ticker)
         sys.exit(1)
@@ -31,65 +74,47 @@ def technicalIndicators(ticker):
     # Alter the record variable to a panda data frame
     # priceRecord = pd.DataFrame(matplotlib.mlab.csv2rec(price)).sort_index(ascending = False)
     
-    # Construct the upper Bollinger band
-    priceRecord['Boll_Upper'] = priceRecord['Close'].rolling(center = False, window = 20).mean() + 2 * priceRecord['Close'].rolling(center = False, window = 20, min_periods = 20).std()
+    # Every line on the chart comes from the indicator registry the screen
+    # uses, computed together in one pass over the ticker's prices
+    from DividendIndicators import (rsiPeriod, buildPriceMatrices, indicatorFields,
+                                    indicatorSeries)
+    names = chartIndicators + chartOverlays
+    history = indicatorSeries(buildPriceMatrices([priceRecord], indicatorFields(names)), names)
+    for name in names:
+        priceRecord[name] = history[name][:, 0]
     
-    # Construct the lower Bollinger band
-    priceRecord['Boll_Lower'] = priceRecord['Close'].rolling(center = False, window = 20).mean() - 2 * priceRecord['Close'].rolling(center = False, window = 20, min_periods = 20).std()
-    
-    # Begin the calculation of the RSI
-    # Start by creating the price change
-    priceChange = priceRecord['Close'].diff()
-    
-    # Remove the first row since it is Nan
-    priceChange = priceChange[1:]
-
-    # Create the positive gains and the negative gains series
-    priceGain, priceLoss = priceChange.copy(), priceChange.copy()
-    
-    # Reset each new series based on the price change value
-    priceGain[priceGain < 0] = 0
-    priceLoss[priceLoss > 0] = 0
-    
-    # Calculate the EWMA
-    rollUp = priceGain.ewm(ignore_na = False, adjust = True, min_periods = 14, com = 14).mean()
-    rollDown = priceLoss.abs().ewm(ignore_na = False, adjust = True, min_periods = 14, com = 14).mean()
-    
-    # Calculate the RSI
-    relativeStrength = rollUp / rollDown
-    relativeStrengthIndex = 100.0 - (100.0 / (1.0 + relativeStrength))
-    relativeStrengthIndex[relativeStrengthIndex > 100] = 100
-    relativeStrengthIndex[relativeStrengthIndex < 0] = 0
-    
-    # ROC calculation is close divided by close twelve trading days ago
-    priceRecord['ROC'] = priceRecord['Close'].pct_change(periods = 12)
+    # The RSI is only drawn once the first 14 day average exists
+    relativeStrengthIndex = priceRecord['RSI'].copy()
+    relativeStrengthIndex.iloc[:rsiPeriod] = float('nan')
     
     # Construct the text box text to show the latest values
-    bollPct = (priceRecord[-1:]['Close'] - priceRecord[-1:]['Boll_Lower']) / (priceRecord[-1:]['Boll_Upper'] - priceRecord[-1:]['Boll_Lower'])
+    lastRecord = priceRecord.iloc[-1]
+    bollPct = lastRecord['bollPct'] / 100
     textBox = 'Ticker: %-5s\nLast values\nPrice %.2f\nBoll Pct %.3f\nROC %.1f\nRSI %.1f'%(ticker,
-                                                                            priceRecord[-1:]['Close'],
+                                                                            lastRecord['Close'],
                                                                             bollPct,
-                                                                            priceRecord[-1:]['ROC'] * 100,
-                                                                            relativeStrengthIndex[-1:])
-    boxProperties = dict(boxstyle = 'round', facecolor = 'wheat', alpha = 0.5)
-    
+                                                                            lastRecord['ROC'] * 100,
+                                                                            relativeStrengthIndex.iloc[-1])
+    return priceRecord, relativeStrengthIndex, textBox
+
+
+def buildFigure():
     # Construct three subplots within the figure
     # They should share the same x - axis
     fig, (ax1, ax2, ax3) = plt.subplots(3, sharex = True, figsize = (10, 10))
+    ax1.xaxis_date()
     
     # The first subplot will contain the Bollinger Bands
-    ax1.plot(priceRecord.index.values, priceRecord.Close, label = 'Close', color = 'blue')
-    ax1.plot(priceRecord.index.values, priceRecord.Boll_Lower, label = 'Lower', color = 'green')
-    ax1.plot(priceRecord.index.values, priceRecord.Boll_Upper, label = 'Upper', color = 'red')
-    
-    # The dates on the x-axis overlap and need to be auto formatted
-    fig.autofmt_xdate()
+    closeLine, = ax1.plot([], [], label = 'Close', color = 'blue')
+    lowerLine, = ax1.plot([], [], label = 'Lower', color = 'green')
+    upperLine, = ax1.plot([], [], label = 'Upper', color = 'red')
+    overlayLines = [ax1.plot([], [], label = name, linewidth = 1)[0] for name in chartOverlays]
     
     # When moving the mouse, the date needs to be changed from the %b %Y default
     ax1.fmt_xdata = matplotlib.dates.DateFormatter('%b %d')
     
     # The second subplot contains the rate of change line
-    ax2.plot(priceRecord.index.values, priceRecord.ROC, label = 'ROC', color = 'black')
+    rocLine, = ax2.plot([], [], label = 'ROC', color = 'black')
     
     # Add a trigger line to show the -10% value
     ax2.axhline(-0.1, linewidth= 2, color = 'red')
@@ -98,7 +123,7 @@ def technicalIndicators(ticker):
     ax2.fmt_xdata = matplotlib.dates.DateFormatter('%b %d')
     
     # The third subplot contains the relative strength index line
-    ax3.plot(priceRecord.index.values[1:], relativeStrengthIndex, color = 'black')
+    rsiLine, = ax3.plot([], [], color = 'black')
     
     # When moving the mouse, the date needs to be changed from the %b %Y default
     ax3.fmt_xdata = matplotlib.dates.DateFormatter('%b %d')
@@ -107,22 +132,237 @@ def technicalIndicators(ticker):
     ax3.axhspan(30, 70, facecolor = 'yellow', alpha = 0.25)
     
     # Add the textbox to the first subplot
-    ax1.text(0.05, 0.95, textBox, transform = ax1.transAxes, fontsize = 14, verticalalignment = 'top', bbox = boxProperties)
+    boxProperties = dict(boxstyle = 'round', facecolor = 'wheat', alpha = 0.5)
+    textArtist = ax1.text(0.05, 0.95, '', transform = ax1.transAxes, fontsize = 14, verticalalignment = 'top', bbox = boxProperties)
     
-    # Tighten up the layout so there is less white space on the sides
-    fig.tight_layout()
+    return {'fig' : fig, 'axes' : (ax1, ax2, ax3), 'close' : closeLine,
+            'lower' : lowerLine, 'upper' : upperLine, 'overlays' : overlayLines,
+            'roc' : rocLine,
+            'rsi' : rsiLine, 'text' : textArtist, 'laidOut' : False}
+
+
+def drawFigure(layout, priceRecord, relativeStrengthIndex, textBox):
+    # Point the existing lines at this ticker's data
+    dates = priceRecord.index.values
+    layout['close'].set_data(dates, priceRecord.Close.values)
+    layout['lower'].set_data(dates, priceRecord.lowerBound.values)
+    layout['upper'].set_data(dates, priceRecord.upperBound.values)
+    for name, overlayLine in zip(chartOverlays, layout['overlays']):
+        overlayLine.set_data(dates, priceRecord[name].values)
+    layout['roc'].set_data(dates, priceRecord.ROC.values)
+    layout['rsi'].set_data(dates, relativeStrengthIndex.values)
+    layout['text'].set_text(textBox)
+    for ax in layout['axes']:
+        ax.relim()
+        ax.autoscale_view()
+    
+    # Lay the figure out once, later tick labels copy the first one's style
+    if not layout['laidOut']:
+        # The dates on the x-axis overlap and need to be auto formatted
+        layout['fig'].autofmt_xdate()
+        
+        # Tighten up the layout so there is less white space on the sides
+        layout['fig'].tight_layout()
+        layout['laidOut'] = True
+    return
+
+
+def technicalIndicators(ticker):
+    # Draw one ticker on a new figure
+    loadPyplot()
+    with timeStage('chartData', ticker):
+        priceData = chartData(ticker)
+    with timeStage('render', ticker):
+        drawFigure(buildFigure(), *priceData)
     
     # printPages.savefig()
     # plt.show()
     # printPages.close()
     return
 
+
+def renderWorker(matrixPath = None):
+    # Worker processes never show a window so they can draw off screen
+    global batchFetcher
+    loadPyplot(headless = True)
+    if matrixPath is not None:
+        from DividendPriceMatrix import matrixFetcher
+        batchFetcher = matrixFetcher(matrixPath)
+    return
+
+
+def renderPage(ticker, pagePath, note = None):
+    # Draw one ticker on the worker's reusable figure and save it as a page
+    # for the parent to collect, along with the ticker's timings. A note,
+    # such as the watchlist status, is added to the text box.
+    global batchLayout
+    if batchLayout is None:
+        batchLayout = buildFigure()
+    with timeStage('chartData', ticker):
+        priceRecord, relativeStrengthIndex, textBox = chartData(ticker)
+    if note:
+        textBox += '\n' + note
+    with timeStage('render', ticker):
+        drawFigure(batchLayout, priceRecord, relativeStrengthIndex, textBox)
+        batchLayout['fig'].savefig(pagePath, dpi = pageDpi)
+    return pagePath, tickerMetrics.get(ticker, {})
+
+
+def pageFormat():
+    # With pypdf installed the workers write single page pdfs that are
+    # merged as vectors, otherwise they write images placed one per page
+    return 'pdf' if importlib.util.find_spec('pypdf') is not None else 'png'
+
+
+def assemblePages(pagePaths, pdfFile, pageType):
+    # Put the pages into one pdf in the order given
+    if pageType == 'pdf':
+        from pypdf import PdfWriter
+        printPages = PdfWriter()
+        for pagePath in pagePaths:
+            printPages.append(pagePath)
+        printPages.write(pdfFile)
+        printPages.close()
+    else:
+        # Create the object to hold the pdf output
+        printPages = PdfPages(pdfFile)
+        for pagePath in pagePaths:
+            image = plt.imread(pagePath)
+            fig = plt.figure(figsize = (image.shape[1] / pageDpi,
+                                        image.shape[0] / pageDpi),
+                             dpi = pageDpi)
+            fig.figimage(image)
+            printPages.savefig(fig, dpi = pageDpi)
+            plt.close(fig)
+
+        # Close out the pdf file
+        printPages.close()
+    return
+
+
+def renderBatch(tickers, pdfFile = 'DividendGraphs.pdf', workers = None):
+    # Fan the figures out across a process pool, then put the pages into
+    # one pdf in the order the tickers were given
+    pageType = pageFormat()
+    loadPyplot(headless = True)
+    with tempfile.TemporaryDirectory() as pageDir:
+        # Fetch every ticker here at once and hand the prices to the workers
+        # as a memory mapped matrix, rather than a cache lookup per page
+        from DividendPriceMatrix import buildPriceMatrix
+        matrixPath = os.path.join(pageDir, 'prices')
+        endDate = datetime.datetime.now()
+        with timeStage('fetch'):
+            failed = buildPriceMatrix(matrixPath, tickers,
+                                      endDate - datetime.timedelta(days = 365), endDate)
+        if failed:
+            print(' Left out {0} tickers: {1}'.format(len(failed), ', '.join(failed)))
+            tickers = [ticker for ticker in tickers if ticker not in failed]
+
+        pagePaths = [os.path.join(pageDir, '{0:05d}.{1}'.format(i, pageType))
+                     for i in range(len(tickers))]
+        with ProcessPoolExecutor(max_workers = workers, initializer = renderWorker,
+                                 initargs = (matrixPath,)) as executor:
+            pages = list(executor.map(renderPage, tickers, pagePaths))
+        pagePaths = [pagePath for pagePath, _ in pages]
+        mergeTickers(dict((ticker, metrics) for ticker, (_, metrics) in zip(tickers, pages)))
+        assemblePages(pagePaths, pdfFile, pageType)
+    return
+
+
+def pageKey(ticker, note, pageType):
+    # Hash of everything drawn on a ticker's page: the dates up to the last
+    # bar, every line on the chart, the text box and the note
+    priceRecord, relativeStrengthIndex, textBox = chartData(ticker)
+    digest = hashlib.sha1(repr((ticker, str(priceRecord.index[-1]), textBox, note, pageType,
+                                pageDpi, chartIndicators, chartOverlays)).encode())
+    digest.update(priceRecord.index.values.tobytes())
+    digest.update(priceRecord[['Close'] + chartIndicators + chartOverlays]
+                  .to_numpy(dtype = float).tobytes())
+    digest.update(relativeStrengthIndex.to_numpy(dtype = float).tobytes())
+    return digest.hexdigest()
+
+
+def renderReport(pdfFile = 'DividendReport.pdf', workers = None):
+    # One page per ticker on the watchlists DividendTickersCCC.py keeps, in
+    # list order with the list and status on the page. Pages whose hash is
+    # already in pageCache are reused, so a rebuild only draws the tickers
+    # whose prices or status moved since the last report.
+    global batchFetcher
+    from DividendUniverse import cccFileSets, loadWatchlist, watchStatus
+
+    entries = []
+    for csvTickerFile, csvResultFile, csvWatchlistFile, descriptor in cccFileSets:
+        if os.path.exists(csvWatchlistFile):
+            entries.extend((ticker, '{0} {1}'.format(descriptor, watchStatus[code]))
+                           for ticker, code in loadWatchlist(csvWatchlistFile).items())
+    tickers = list(dict.fromkeys(ticker for ticker, _ in entries))
+
+    pageType = pageFormat()
+    loadPyplot(headless = True)
+    os.makedirs(pageCache, exist_ok = True)
+    with tempfile.TemporaryDirectory() as pageDir:
+        from DividendPriceMatrix import buildPriceMatrix, matrixFetcher
+        matrixPath = os.path.join(pageDir, 'prices')
+        endDate = datetime.datetime.now()
+        with timeStage('fetch'):
+            failed = buildPriceMatrix(matrixPath, tickers,
+                                      endDate - datetime.timedelta(days = 365), endDate)
+        if failed:
+            print(' Left out {0} tickers: {1}'.format(len(failed), ', '.join(failed)))
+            entries = [(ticker, note) for ticker, note in entries if ticker not in failed]
+
+        # The hashes read the same matrix the workers draw from
+        batchFetcher = matrixFetcher(matrixPath)
+        try:
+            with timeStage('pageKeys'):
+                pagePaths = [os.path.join(pageCache, '{0}.{1}'.format(
+                             pageKey(ticker, note, pageType), pageType))
+                             for ticker, note in entries]
+        finally:
+            batchFetcher = None
+
+        # Pages are drawn in the scratch folder and moved into the cache once
+        # complete, so a run stopped part way never leaves a broken page
+        missing = dict((pagePath, entry) for entry, pagePath in zip(entries, pagePaths)
+                       if not os.path.exists(pagePath))
+        if missing:
+            scratchPaths = [os.path.join(pageDir, os.path.basename(pagePath))
+                            for pagePath in missing]
+            with ProcessPoolExecutor(max_workers = workers, initializer = renderWorker,
+                                     initargs = (matrixPath,)) as executor:
+                pages = list(executor.map(renderPage,
+                                          [ticker for ticker, _ in missing.values()],
+                                          scratchPaths,
+                                          [note for _, note in missing.values()]))
+            for (pagePath, (ticker, _)), (scratchPath, metrics) in zip(missing.items(), pages):
+                os.replace(scratchPath, pagePath)
+                mergeTickers({ticker : metrics})
+
+    assemblePages(pagePaths, pdfFile, pageType)
+
+    # Drop pages no longer in the report
+    for name in os.listdir(pageCache):
+        if os.path.join(pageCache, name) not in pagePaths:
+            os.remove(os.path.join(pageCache, name))
+    print(' {0} pages, {1} drawn, {2} from {3}'.format(len(pagePaths), len(missing),
+                                                      len(pagePaths) - len(missing), pageCache))
+    return
+
+
 def main():
-    if len(sys.argv) == 2:
+    if '--report' in sys.argv:
+        # Redraw only the watchlist pages that changed since the last report
+        renderReport()
+    elif '--batch' in sys.argv:
+        # Render the tickers in parallel, one process per core
+        renderBatch([arg for arg in sys.argv[1:] if arg != '--batch'])
+    elif len(sys.argv) == 2:
         # Only one ticker was input
         technicalIndicators(sys.argv[1])
         plt.show()
     else:
+        loadPyplot()
+
         # Create the object to hold the pdf output
         printPages = PdfPages('DividendGraphs.pdf')
         
@@ -139,10 +379,12 @@ def main():
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
-        print(' Usage is DividendGraphs.py followed by a ticker')
+        print(' Usage is DividendGraphs.py [--batch] followed by a ticker, or --report')
         sys.exit(1)
     
     print(' ***** Beginning code execution *****')
+    profiler = startRun()
     main()
+    finishRun('DividendGraphs', profiler)
     print(' ***** Ending code execution *****')
     
\ No newline at end of file
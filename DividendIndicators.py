@@ -0,0 +1,522 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+
+# Indicator settings used by the screen
+bollWindow = 20
+rsiPeriod = 14
+rocPeriod = 12
+
+
+def buildCloseMatrix(closeSeries):
+    # Stack a list of close price series (oldest bar first) into a
+    # days x tickers array. Series of different lengths are aligned on
+    # their newest bar and padded at the top with NaN, so row -1 is always
+    # the latest close for every ticker.
+    maxLength = max([len(series) for series in closeSeries], default = 0)
+    closeMatrix = np.full((maxLength, len(closeSeries)), np.nan)
+    for column, series in enumerate(closeSeries):
+        values = np.asarray(series, dtype = float)
+        if len(values) > 0:
+            closeMatrix[maxLength - len(values):, column] = values
+    return closeMatrix
+
+
+def bollinger(closeMatrix, window = bollWindow):
+    # Bollinger Bands are 20-day SMA +/- 20-day standard deviation * 2
+    # Series shorter than the window use whatever bars they have
+    recent = closeMatrix[-window:]
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        ma20day = np.nanmean(recent, axis = 0)
+        st20day = np.nanstd(recent, axis = 0)
+        lowerBound = ma20day - 2 * st20day
+        upperBound = ma20day + 2 * st20day
+        bollPct = (closeMatrix[-1] - lowerBound) / (upperBound - lowerBound) * 100
+    return bollPct, lowerBound
+
+
+def wilderAverages(closeMatrix, period = rsiPeriod):
+    # RSI is multi-step
+    # First Average Gain = Sum of Gains over the Past 14 Periods / 14
+    # First Average Loss = Sum of Losses over the Past 14 Periods / 14
+    # Subsequent calculations are:
+    # Average Gain = [(previous average gain * 13) + current gain] / 14
+    # Average Loss = [(previous average loss * 13) + current loss] / 14
+    #
+    # Unrolling the recursion, the final average is the seed scaled by
+    # (13/14)^n plus every later gain weighted by (13/14)^age / 14. Because
+    # the series are aligned on their newest bar the age weights are shared
+    # by every ticker, so the whole smoothing is one weighted sum per column.
+    # Columns with fewer than 14 changes return their partial seed sum / 14
+    # together with the number of changes seen.
+    priceChange = np.diff(closeMatrix, axis = 0)
+    nChanges = priceChange.shape[0]
+    validCount = np.sum(~np.isnan(priceChange), axis = 0)
+    firstValid = nChanges - validCount
+
+    # NaN padding compares False on both sides and drops out here
+    with np.errstate(invalid = 'ignore'):
+        priceGain = np.where(priceChange > 0, priceChange, 0.0)
+        priceLoss = np.where(priceChange < 0, -priceChange, 0.0)
+
+    rowIndex = np.arange(nChanges)[:, np.newaxis]
+    seedMask = (rowIndex >= firstValid) & (rowIndex < firstValid + period)
+    smoothMask = rowIndex >= firstValid + period
+
+    decay = (period - 1.0) / period
+    ageWeight = (decay ** (nChanges - 1 - np.arange(nChanges)) / period)[:, np.newaxis]
+    seedWeight = decay ** np.maximum(validCount - period, 0)
+
+    avgGain = (np.sum(priceGain * seedMask, axis = 0) / period * seedWeight
+               + np.sum(priceGain * smoothMask * ageWeight, axis = 0))
+    avgLoss = (np.sum(priceLoss * seedMask, axis = 0) / period * seedWeight
+               + np.sum(priceLoss * smoothMask * ageWeight, axis = 0))
+    return avgGain, avgLoss, validCount
+
+
+def relativeStrength(avgGain, avgLoss):
+    # RS = average gain / average loss
+    # RSI = 100 - 100 / (1 + RS)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        RSI = np.where(avgLoss > 0, 100.0 - 100.0 / (1.0 + avgGain / avgLoss), 100.0)
+    return RSI
+
+
+def wilderRSI(closeMatrix, period = rsiPeriod):
+    avgGain, avgLoss, validCount = wilderAverages(closeMatrix, period)
+    RSI = relativeStrength(avgGain, avgLoss)
+
+    # Not enough history for the first average gives a neutral 100
+    RSI[validCount < period] = 100.0
+    return RSI
+
+
+def rateOfChange(closeMatrix, period = rocPeriod):
+    # ROC calculation is close divided by close twelve trading days ago
+    validCount = np.sum(~np.isnan(closeMatrix), axis = 0)
+    if closeMatrix.shape[0] <= period:
+        return np.zeros(closeMatrix.shape[1])
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        ROC = closeMatrix[-1] / closeMatrix[-1 - period] - 1
+    ROC[validCount <= period + 1] = 0.0
+    return ROC
+
+
+def oversoldCount(bollPct, RSI, ROC):
+    # Score one point for each oversold signal
+    with np.errstate(invalid = 'ignore'):
+        counter = ((np.asarray(bollPct) < 0).astype(int)
+                   + (np.asarray(RSI) < 30).astype(int)
+                   + (np.asarray(ROC) < -.1).astype(int))
+    return counter
+
+
+def computeIndicators(closeMatrix):
+    # Run every screening indicator over a days x tickers close matrix
+    # and return one array per measure, indexed by ticker column
+    closeMatrix = np.asarray(closeMatrix, dtype = float)
+    if closeMatrix.shape[0] == 0:
+        # Nothing was fetched so there is nothing to score
+        empty = np.full(closeMatrix.shape[1], np.nan)
+        return {'Close' : empty, 'bollPct' : empty, 'lowerBound' : empty,
+                'RSI' : empty, 'ROC' : empty,
+                'Count' : np.zeros(closeMatrix.shape[1], dtype = int)}
+
+    bollPct, lowerBound = bollinger(closeMatrix)
+    RSI = wilderRSI(closeMatrix)
+    ROC = rateOfChange(closeMatrix)
+
+    counter = oversoldCount(bollPct, RSI, ROC)
+
+    return {'Close' : closeMatrix[-1], 'bollPct' : bollPct,
+            'lowerBound' : lowerBound, 'RSI' : RSI, 'ROC' : ROC,
+            'Count' : counter}
+
+
+# Indicator registry
+#
+# Every indicator the screen, the backtest and the charts can show is
+# registered by name with a function that builds its whole history as a
+# days x tickers array. indicatorSeries computes any selection of them in
+# one pass over the price matrices. The intermediates behind them, the
+# price changes, the running sums of every moving window and the recursive
+# averages, are built once in a shared dict and reused by every indicator
+# that reads them, and the recursive averages of every selected indicator
+# are stepped through the days together in a single loop. Adding an
+# indicator adds its own arithmetic, not another scan of the prices.
+#
+# computeIndicators above and the saved state in DividendState are the
+# newest bar shortcuts of the bollPct, RSI and ROC defined here.
+
+# Periods of the moving average families
+smaPeriods = (20, 50, 200)
+emaPeriods = (12, 26, 50)
+macdPeriods = (12, 26, 9)
+stochPeriods = (14, 3)
+atrPeriod = 14
+
+# Trading days of dividends counted in the trailing yield
+yieldDays = 252
+
+# name : {'compute', 'needs', 'smooths', 'fields'}, filled in below
+indicatorRegistry = {}
+
+# What the screen scores and the backtest replays
+screenIndicators = ['Close', 'bollPct', 'lowerBound', 'RSI', 'ROC', 'Count']
+
+
+def registerIndicator(name, compute, needs = (), smooths = (), fields = ('Close',)):
+    # compute(shared) returns the days x tickers history. needs lists the
+    # other indicators it reads, smooths the recursive averages it reads
+    # and fields the price columns it uses.
+    indicatorRegistry[name] = {'compute' : compute, 'needs' : tuple(needs),
+                               'smooths' : tuple(smooths), 'fields' : tuple(fields)}
+    return
+
+
+def wilderAverage(inputName, period):
+    # Recursive averages are (input, period, weight): seeded with the mean
+    # of the first period values, then average = (average * (weight - 1)
+    # + value) / weight. Wilder's smoothing uses weight = period.
+    return (inputName, period, float(period))
+
+
+def expAverage(inputName, period):
+    # Exponential average, alpha = 2 / (period + 1)
+    return (inputName, period, (period + 1) / 2.0)
+
+
+def sharedValue(shared, key, build):
+    # Build an intermediate the first time any indicator asks for it
+    if key not in shared:
+        shared[key] = build()
+    return shared[key]
+
+
+def indicatorValue(shared, name):
+    return sharedValue(shared, ('indicator', name),
+                       lambda: indicatorRegistry[name]['compute'](shared))
+
+
+def fieldMatrix(shared, field):
+    # High and Low fall back to the close when a source only has closes,
+    # dividends to NaN when it has none
+    if field in shared['fields']:
+        return shared['fields'][field]
+    if field in ('High', 'Low', 'Open'):
+        return shared['fields']['Close']
+    return sharedValue(shared, ('missing', field),
+                       lambda: np.full(shared['fields']['Close'].shape, np.nan))
+
+
+def priceChange(shared):
+    # Close to close changes, NaN on each ticker's first bar
+    def build():
+        closeMatrix = fieldMatrix(shared, 'Close')
+        change = np.full(closeMatrix.shape, np.nan)
+        change[1:] = np.diff(closeMatrix, axis = 0)
+        return change
+    return sharedValue(shared, 'change', build)
+
+
+def priceGain(shared):
+    def build():
+        change = priceChange(shared)
+        with np.errstate(invalid = 'ignore'):
+            gain = np.where(change > 0, change, 0.0)
+        gain[np.isnan(change)] = np.nan
+        return gain
+    return sharedValue(shared, 'gain', build)
+
+
+def priceLoss(shared):
+    def build():
+        change = priceChange(shared)
+        with np.errstate(invalid = 'ignore'):
+            loss = np.where(change < 0, -change, 0.0)
+        loss[np.isnan(change)] = np.nan
+        return loss
+    return sharedValue(shared, 'loss', build)
+
+
+def trueRange(shared):
+    # The larger of today's range and the gap from yesterday's close
+    def build():
+        high = fieldMatrix(shared, 'High')
+        low = fieldMatrix(shared, 'Low')
+        previousClose = fieldMatrix(shared, 'Close') - priceChange(shared)
+        return np.fmax(high - low, np.fmax(np.abs(high - previousClose),
+                                           np.abs(low - previousClose)))
+    return sharedValue(shared, 'trueRange', build)
+
+
+# Intermediates the windows and averages can read besides price fields
+# and registered indicators
+sharedInputs = {'change' : priceChange, 'gain' : priceGain, 'loss' : priceLoss,
+                'trueRange' : trueRange}
+
+
+def seriesInput(shared, name):
+    if name in sharedInputs:
+        return sharedInputs[name](shared)
+    if name in indicatorRegistry:
+        return indicatorValue(shared, name)
+    return fieldMatrix(shared, name)
+
+
+def movingWindow(shared, inputName, window):
+    # (count, total, mean) of the values present in the last window rows,
+    # from running sums kept once per input. Windows shorter than window at
+    # the start of a series use what they have.
+    def cumulative():
+        values = seriesInput(shared, inputName)
+        valid = ~np.isnan(values)
+        filled = np.where(valid, values, 0.0)
+        zeroRow = np.zeros((1, values.shape[1]))
+        return (np.concatenate([zeroRow, np.cumsum(filled, axis = 0)]),
+                np.concatenate([zeroRow, np.cumsum(valid, axis = 0)]))
+
+    def build():
+        sums, counts = sharedValue(shared, ('cumulative', inputName), cumulative)
+        nDays = sums.shape[0] - 1
+        windowStart = np.maximum(np.arange(1, nDays + 1) - window, 0)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            windowCount = counts[1:] - counts[windowStart]
+            total = sums[1:] - sums[windowStart]
+            mean = total / windowCount
+        return windowCount, total, mean
+    return sharedValue(shared, ('window', inputName, window), build)
+
+
+def movingSpread(shared, inputName, window):
+    # (mean, standard deviation) of the values present in the last window
+    # rows, summed one pass per row of the window instead of from running
+    # sums, and with the squares taken about each window's own mean, so the
+    # error does not grow with the length of the history
+    def build():
+        values = seriesInput(shared, inputName)
+        windowCount, _, _ = movingWindow(shared, inputName, window)
+        valid = ~np.isnan(values)
+        filled = np.where(valid, values, 0.0)
+        nDays = values.shape[0]
+        total = np.zeros(values.shape)
+        for lag in range(min(window, nDays)):
+            total[lag:] += filled[:nDays - lag]
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            mean = total / windowCount
+            squares = np.zeros(values.shape)
+            for lag in range(min(window, nDays)):
+                deviation = (filled[:nDays - lag] - mean[lag:]) * valid[:nDays - lag]
+                squares[lag:] += deviation * deviation
+            return mean, np.sqrt(squares / windowCount)
+    return sharedValue(shared, ('spread', inputName, window), build)
+
+
+def rollingExtreme(shared, field, window, extreme):
+    # Highest (np.fmax) or lowest (np.fmin) value of the last window rows
+    def build():
+        values = fieldMatrix(shared, field)
+        result = values.copy()
+        for lag in range(1, min(window, values.shape[0])):
+            result[lag:] = extreme(result[lag:], values[:-lag])
+        return result
+    return sharedValue(shared, ('extreme', field, window, extreme.__name__), build)
+
+
+def smoothAll(shared, specs):
+    # Step every requested recursive average through the days in one loop,
+    # all inputs and tickers side by side. Rows before an average has its
+    # full seed are NaN.
+    specs = [spec for spec in dict.fromkeys(specs) if ('smooth', spec) not in shared]
+    if not specs:
+        return
+    inputs = np.stack([seriesInput(shared, spec[0]) for spec in specs])
+    period = np.array([[spec[1]] for spec in specs])
+    weight = np.array([[spec[2]] for spec in specs])
+    average = np.zeros(inputs.shape[::2])
+    seen = np.zeros(inputs.shape[::2], dtype = int)
+    results = np.full(inputs.shape, np.nan)
+    with np.errstate(invalid = 'ignore'):
+        for row in range(inputs.shape[1]):
+            value = inputs[:, row]
+            present = ~np.isnan(value)
+            seeding = present & (seen < period)
+            smoothing = present & ~seeding
+            average = np.where(seeding, average + value / period, average)
+            average = np.where(smoothing, (average * (weight - 1) + value) / weight, average)
+            seen += present
+            results[:, row] = np.where(seen >= period, average, np.nan)
+    for index, spec in enumerate(specs):
+        shared[('smooth', spec)] = results[index]
+    return
+
+
+def smoothed(shared, spec):
+    smoothAll(shared, [spec])
+    return shared[('smooth', spec)]
+
+
+def indicatorClosure(names):
+    # The names with every indicator they read, dependencies first
+    ordered = []
+
+    def visit(name):
+        if name not in ordered:
+            for need in indicatorRegistry[name]['needs']:
+                visit(need)
+            ordered.append(name)
+    for name in names:
+        visit(name)
+    return ordered
+
+
+def indicatorSeries(priceMatrices, names = screenIndicators):
+    # {name : days x tickers history} for the named indicators, from
+    # {field : days x tickers} price matrices aligned like buildCloseMatrix
+    unknown = [name for name in names if name not in indicatorRegistry]
+    if unknown:
+        raise ValueError('unknown indicators: ' + ', '.join(unknown))
+    shared = {'fields' : dict((field, np.asarray(matrix, dtype = float))
+                              for field, matrix in priceMatrices.items())}
+    ordered = indicatorClosure(names)
+
+    # One loop for the averages of the price series, then one for averages
+    # of other indicators, such as the MACD signal line
+    specs = [spec for name in ordered for spec in indicatorRegistry[name]['smooths']]
+    smoothAll(shared, [spec for spec in specs if spec[0] not in indicatorRegistry])
+    smoothAll(shared, [spec for spec in specs if spec[0] in indicatorRegistry])
+
+    return dict((name, indicatorValue(shared, name)) for name in names)
+
+
+def indicatorFields(names):
+    # Price columns the named indicators read
+    fields = []
+    for name in indicatorClosure(names):
+        fields.extend(field for field in indicatorRegistry[name]['fields']
+                      if field not in fields)
+    return fields
+
+
+def buildPriceMatrices(priceRecords, fields):
+    # {field : days x tickers} from a list of price records, each column
+    # aligned on its newest bar. A record without a field gives NaN there.
+    return dict((field, buildCloseMatrix([priceRecord[field] if field in priceRecord
+                                          else np.full(len(priceRecord), np.nan)
+                                          for priceRecord in priceRecords]))
+                for field in fields)
+
+
+def latestIndicators(priceRecords, names):
+    # {name : value per record} on each record's newest bar
+    history = indicatorSeries(buildPriceMatrices(priceRecords, indicatorFields(names)), names)
+    latest = {}
+    for name, values in history.items():
+        latest[name] = values[-1] if len(values) else np.full(len(priceRecords), np.nan)
+    return latest
+
+
+def indicatorHistory(closeMatrix):
+    # The same measures as computeIndicators for every day of the matrix,
+    # each a days x tickers array where row t is what the screen would
+    # have shown on day t. Rows before a ticker's first close are NaN.
+    return indicatorSeries({'Close' : closeMatrix}, screenIndicators)
+
+
+def bollingerBand(shared, side):
+    # Bollinger Bands from the 20 row window, counting only the rows that
+    # hold a close as bollinger() does
+    ma20day, st20day = movingSpread(shared, 'Close', bollWindow)
+    return ma20day + side * 2 * st20day
+
+
+def bollingerPct(shared):
+    lowerBound = indicatorValue(shared, 'lowerBound')
+    upperBound = indicatorValue(shared, 'upperBound')
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return (fieldMatrix(shared, 'Close') - lowerBound) / (upperBound - lowerBound) * 100
+
+
+def historyRSI(shared):
+    avgGain = smoothed(shared, wilderAverage('gain', rsiPeriod))
+    avgLoss = smoothed(shared, wilderAverage('loss', rsiPeriod))
+
+    # Not enough history for the first average gives a neutral 100
+    RSI = np.where(np.isnan(avgGain), 100.0, relativeStrength(avgGain, avgLoss))
+    RSI[np.isnan(fieldMatrix(shared, 'Close'))] = np.nan
+    return RSI
+
+
+def historyROC(shared):
+    # ROC against the close twelve rows back
+    closeMatrix = fieldMatrix(shared, 'Close')
+    ROC = np.zeros(closeMatrix.shape)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        ROC[rocPeriod:] = closeMatrix[rocPeriod:] / closeMatrix[:-rocPeriod] - 1
+    validSoFar = sharedValue(shared, 'validSoFar',
+                             lambda: np.cumsum(~np.isnan(closeMatrix), axis = 0))
+    ROC[validSoFar <= rocPeriod + 1] = 0.0
+    ROC[np.isnan(closeMatrix)] = np.nan
+    return ROC
+
+
+def simpleAverage(shared, inputName, period):
+    # Moving average once the window is full
+    windowCount, _, mean = movingWindow(shared, inputName, period)
+    return np.where(windowCount >= period, mean, np.nan)
+
+
+def stochasticK(shared):
+    # Where the close sits in the range of the last 14 bars, 0 to 100
+    period = stochPeriods[0]
+    highest = rollingExtreme(shared, 'High', period, np.fmax)
+    lowest = rollingExtreme(shared, 'Low', period, np.fmin)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return (fieldMatrix(shared, 'Close') - lowest) / (highest - lowest) * 100
+
+
+def trailingYield(shared):
+    # Dividends paid over the last year as a percent of today's close
+    _, paid, _ = movingWindow(shared, 'Dividend', yieldDays)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return np.where(paid > 0, paid / fieldMatrix(shared, 'Close') * 100, np.nan)
+
+
+registerIndicator('Close', lambda shared: fieldMatrix(shared, 'Close'))
+registerIndicator('lowerBound', lambda shared: bollingerBand(shared, -1))
+registerIndicator('upperBound', lambda shared: bollingerBand(shared, 1))
+registerIndicator('bollPct', bollingerPct, needs = ('lowerBound', 'upperBound'))
+registerIndicator('RSI', historyRSI,
+                  smooths = (wilderAverage('gain', rsiPeriod), wilderAverage('loss', rsiPeriod)))
+registerIndicator('ROC', historyROC)
+registerIndicator('Count', lambda shared: oversoldCount(indicatorValue(shared, 'bollPct'),
+                                                        indicatorValue(shared, 'RSI'),
+                                                        indicatorValue(shared, 'ROC')),
+                  needs = ('bollPct', 'RSI', 'ROC'))
+
+for period in smaPeriods:
+    registerIndicator('SMA{0}'.format(period),
+                      lambda shared, period = period: simpleAverage(shared, 'Close', period))
+for period in emaPeriods:
+    registerIndicator('EMA{0}'.format(period),
+                      lambda shared, period = period: smoothed(shared, expAverage('Close', period)),
+                      smooths = (expAverage('Close', period),))
+
+registerIndicator('MACD', lambda shared: (smoothed(shared, expAverage('Close', macdPeriods[0]))
+                                          - smoothed(shared, expAverage('Close', macdPeriods[1]))),
+                  smooths = (expAverage('Close', macdPeriods[0]),
+                             expAverage('Close', macdPeriods[1])))
+registerIndicator('MACDSignal', lambda shared: smoothed(shared, expAverage('MACD', macdPeriods[2])),
+                  needs = ('MACD',), smooths = (expAverage('MACD', macdPeriods[2]),))
+registerIndicator('MACDHist', lambda shared: (indicatorValue(shared, 'MACD')
+                                              - indicatorValue(shared, 'MACDSignal')),
+                  needs = ('MACD', 'MACDSignal'))
+
+registerIndicator('StochK', stochasticK, fields = ('Close', 'High', 'Low'))
+registerIndicator('StochD', lambda shared: simpleAverage(shared, 'StochK', stochPeriods[1]),
+                  needs = ('StochK',))
+registerIndicator('ATR', lambda shared: smoothed(shared, wilderAverage('trueRange', atrPeriod)),
+                  smooths = (wilderAverage('trueRange', atrPeriod),),
+                  fields = ('Close', 'High', 'Low'))
+registerIndicator('Yield', trailingYield, fields = ('Close', 'Dividend'))
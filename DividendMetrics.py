@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Set DIVIDEND_METRICS to a .json or .csv path to keep the run's metrics,
+# and DIVIDEND_PROFILE to cprofile or pyinstrument to profile the run
+metricsEnv = 'DIVIDEND_METRICS'
+profileEnv = 'DIVIDEND_PROFILE'
+
+# Counters per ticker, e.g. fetchSeconds, rows, retries, cacheHit
+tickerMetrics = {}
+# Seconds per stage of the run, e.g. fetch, indicators, results
+stageSeconds = {}
+
+metricsLock = threading.Lock()
+
+
+def countTicker(ticker, name, amount = 1):
+    with metricsLock:
+        counters = tickerMetrics.setdefault(ticker, {})
+        counters[name] = counters.get(name, 0) + amount
+    return
+
+
+def setTicker(ticker, name, value):
+    with metricsLock:
+        tickerMetrics.setdefault(ticker, {})[name] = value
+    return
+
+
+def mergeTickers(metrics):
+    # Fold in counters collected by a worker process
+    for ticker, counters in metrics.items():
+        for name, value in counters.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                countTicker(ticker, name, value)
+            else:
+                setTicker(ticker, name, value)
+    return
+
+
+@contextmanager
+def timeStage(name, ticker = None):
+    # Add the time spent in the block to a run stage, or to a ticker's
+    # '<name>Seconds' counter when a ticker is given
+    startTime = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - startTime
+        if ticker is None:
+            with metricsLock:
+                stageSeconds[name] = stageSeconds.get(name, 0.0) + elapsed
+        else:
+            countTicker(ticker, name + 'Seconds', elapsed)
+
+
+def residentMegabytes():
+    # Resident memory of this process now, read from /proc on Linux. Other
+    # systems only report the peak so far, which is still an upper bound.
+    try:
+        with open('/proc/self/statm', 'r') as fileIn:
+            return int(fileIn.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def summaryTable():
+    lines = [' Stage                     Seconds']
+    for name, seconds in stageSeconds.items():
+        lines.append(' {0:<24} {1:9.3f}'.format(name, seconds))
+
+    # Totals of every numeric ticker counter
+    totals = {}
+    for counters in tickerMetrics.values():
+        for name, value in counters.items():
+            if isinstance(value, (int, float)):
+                totals[name] = totals.get(name, 0) + value
+    if totals:
+        lines.append(' Ticker counter (all {0} tickers)'.format(len(tickerMetrics)))
+        for name in sorted(totals):
+            lines.append(' {0:<24} {1:9.3f}'.format(name, totals[name]))
+
+    # The slowest fetches are usually what makes a morning run slow
+    slowest = sorted(tickerMetrics.items(),
+                     key = lambda item: item[1].get('fetchSeconds', 0.0), reverse = True)[:5]
+    if slowest and slowest[0][1].get('fetchSeconds'):
+        lines.append(' Slowest fetches')
+        for ticker, counters in slowest:
+            lines.append(' {0:<24} {1:9.3f}'.format(ticker, counters.get('fetchSeconds', 0.0)))
+    return '\n'.join(lines)
+
+
+def writeMetrics(path):
+    if path.endswith('.csv'):
+        names = sorted(set(name for counters in tickerMetrics.values() for name in counters))
+        with open(path, 'w', newline = '') as fileOut:
+            metricsWriter = csv.writer(fileOut)
+            metricsWriter.writerow(['Ticker'] + names)
+            for ticker, counters in tickerMetrics.items():
+                metricsWriter.writerow([ticker] + [counters.get(name, '') for name in names])
+            # Run stages go last with an empty ticker column
+            for name, seconds in stageSeconds.items():
+                metricsWriter.writerow(['', 'stage:' + name, seconds])
+    else:
+        with open(path, 'w') as fileOut:
+            json.dump({'stages' : stageSeconds, 'tickers' : tickerMetrics}, fileOut,
+                      indent = 2)
+    return
+
+
+def startRun():
+    # Start the opt in profiler, if one was asked for
+    profiler = None
+    profileType = os.environ.get(profileEnv, '').lower()
+    if profileType == 'pyinstrument':
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+    elif profileType:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    return profiler
+
+
+def finishRun(scriptName, profiler = None):
+    # Print the summary and write out the metrics and profile, if requested
+    if profiler is not None:
+        if os.environ.get(profileEnv, '').lower() == 'pyinstrument':
+            profiler.stop()
+            with open(scriptName + '.profile.html', 'w') as fileOut:
+                fileOut.write(profiler.output_html())
+        else:
+            profiler.disable()
+            profiler.dump_stats(scriptName + '.prof')
+
+    if stageSeconds or tickerMetrics:
+        print(summaryTable(), flush = True)
+    metricsFile = os.environ.get(metricsEnv)
+    if metricsFile:
+        writeMetrics(metricsFile)
+    return
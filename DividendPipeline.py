@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+import queue
+import threading
+from DividendFetch import fetchPrices
+from DividendMetrics import timeStage
+from DividendState import screenRecords
+
+
+# Items each queue between stages can hold. A full queue holds back the
+# stage in front of it, so a slow stage slows the downloads down instead
+# of piling up price records in memory.
+queueDepth = 100
+
+# Marks the end of a stage's output
+finished = object()
+
+
+def handOn(stageQueue, item, stopping):
+    # Wait for room in the next stage's queue, giving up once the run stops
+    while not stopping.is_set():
+        try:
+            stageQueue.put(item, timeout = 0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def pipelineScreen(tickers, fetcher, beginDate, endDate, batchSize):
+    # Download and score tickers as two overlapping stages, each on its own
+    # thread, and yield (screened, failed) for every scored batch so the
+    # caller can write results while later tickers are still downloading.
+    #
+    #   fetch     fetchPrices on its thread pool, in finishing order
+    #   compute   screenRecords over whatever has arrived, up to batchSize
+    #
+    # Scoring is one vectorized batch at a time against the indicator state
+    # store, which takes one writer, so there is a single compute thread.
+    fetchQueue = queue.Queue(queueDepth)
+    resultQueue = queue.Queue(queueDepth)
+    stopping = threading.Event()
+
+    def fetchStage():
+        try:
+            with timeStage('fetch'):
+                for ticker, priceRecord in fetchPrices(tickers, beginDate, endDate,
+                                                       fetcher = fetcher):
+                    if not handOn(fetchQueue, (ticker, priceRecord), stopping):
+                        return
+        except BaseException as err:
+            handOn(fetchQueue, err, stopping)
+        finally:
+            handOn(fetchQueue, finished, stopping)
+
+    def computeStage():
+        try:
+            done = False
+            while not done and not stopping.is_set():
+                try:
+                    item = fetchQueue.get(timeout = 0.1)
+                except queue.Empty:
+                    continue
+
+                # Take what is already waiting, up to one batch
+                fetchedRecords = {}
+                failed = []
+                while True:
+                    if item is finished:
+                        done = True
+                        break
+                    if isinstance(item, BaseException):
+                        raise item
+                    ticker, priceRecord = item
+                    if priceRecord is None:
+                        failed.append(ticker)
+                    else:
+                        fetchedRecords[ticker] = priceRecord
+                    if len(fetchedRecords) + len(failed) >= batchSize:
+                        break
+                    try:
+                        item = fetchQueue.get_nowait()
+                    except queue.Empty:
+                        break
+
+                screened = {}
+                if fetchedRecords:
+                    screened = screenRecords(list(fetchedRecords), fetchedRecords)
+                if not handOn(resultQueue, (screened, failed), stopping):
+                    return
+        except BaseException as err:
+            handOn(resultQueue, err, stopping)
+        finally:
+            handOn(resultQueue, finished, stopping)
+
+    stages = [threading.Thread(target = fetchStage, daemon = True),
+              threading.Thread(target = computeStage, daemon = True)]
+    for stage in stages:
+        stage.start()
+    try:
+        while True:
+            item = resultQueue.get()
+            if item is finished:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # Also reached when the caller stops early. The stage threads see
+        # the flag and wind down on their own rather than holding up the
+        # caller behind a slow download.
+        stopping.set()
+    return
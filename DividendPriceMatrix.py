@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+import numpy as np
+
+
+# A price matrix is two files side by side:
+#   <path>.npy    float64 array of fields x tickers x days, NaN where a
+#                 ticker has no bar, opened memory mapped and read only
+#   <path>.json   {'fields', 'tickers', 'dates'} naming each axis
+# Every process that opens it shares the same pages of the file, so
+# handing a universe to a pool of workers costs the same for ten tickers
+# as for ten thousand, and the prices are held in memory once.
+priceFields = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividend']
+
+
+def writePriceMatrix(path, priceRecords):
+    # Lay {ticker : priceRecord} out on one calendar of every date seen
+    import pandas as pd
+
+    tickers = list(priceRecords)
+    dateIndex = pd.DatetimeIndex(sorted(set().union(*[priceRecord.index for priceRecord
+                                                      in priceRecords.values()])))
+    prices = np.lib.format.open_memmap(path + '.npy.tmp', mode = 'w+', dtype = np.float64,
+                                       shape = (len(priceFields), len(tickers), len(dateIndex)))
+    prices[:] = np.nan
+    for row, ticker in enumerate(tickers):
+        priceRecord = priceRecords[ticker]
+        columns = dateIndex.get_indexer(priceRecord.index)
+        for field, name in enumerate(priceFields):
+            if name in priceRecord:
+                prices[field, row, columns] = priceRecord[name].to_numpy(dtype = float)
+    prices.flush()
+    del prices
+
+    with open(path + '.json.tmp', 'w') as fileOut:
+        json.dump({'fields' : priceFields, 'tickers' : tickers,
+                   'dates' : [date.strftime('%Y-%m-%d') for date in dateIndex]}, fileOut)
+    os.replace(path + '.npy.tmp', path + '.npy')
+    os.replace(path + '.json.tmp', path + '.json')
+    return
+
+
+def openPriceMatrix(path):
+    with open(path + '.json', 'r') as fileIn:
+        index = json.load(fileIn)
+    prices = np.load(path + '.npy', mmap_mode = 'r')
+    if prices.shape != (len(index['fields']), len(index['tickers']), len(index['dates'])):
+        raise ValueError('{0}.npy and {0}.json do not match, rebuild the matrix'.format(path))
+    return {'prices' : prices, 'fields' : index['fields'], 'tickers' : index['tickers'],
+            'row' : dict((ticker, row) for row, ticker in enumerate(index['tickers'])),
+            'dates' : np.array(index['dates'], dtype = 'datetime64[D]')}
+
+
+def matrixRecord(matrix, ticker, beginDate, endDate):
+    # One ticker's bars between the dates as a priceRecord. The slice of
+    # the mapped file is a view, only the ticker's own bars are copied.
+    import pandas as pd
+
+    dates = matrix['dates']
+    first = np.searchsorted(dates, np.datetime64(beginDate.date()), side = 'left')
+    last = np.searchsorted(dates, np.datetime64(endDate.date()), side = 'right')
+    block = matrix['prices'][:, matrix['row'][ticker], first:last]
+    present = ~np.isnan(block[matrix['fields'].index('Close')])
+    priceRecord = pd.DataFrame(block[:, present].T, columns = matrix['fields'],
+                               index = pd.DatetimeIndex(dates[first:last][present]))
+    priceRecord.index.name = 'Date'
+    return priceRecord
+
+
+def matrixFetcher(path):
+    # Serve prices from a price matrix. The file is opened on first use, so
+    # the fetcher can be built before a process pool starts. The prices are
+    # already on local disk, so the price cache passes it straight through.
+    opened = []
+
+    def fetcher(ticker, beginDate, endDate):
+        if not opened:
+            opened.append(openPriceMatrix(path))
+        if ticker not in opened[0]['row']:
+            raise IOError('{0} is not in the price matrix {1}'.format(ticker, path))
+        return matrixRecord(opened[0], ticker, beginDate, endDate)
+
+    fetcher.skipCache = True
+    return fetcher
+
+
+def buildPriceMatrix(path, tickers, beginDate, endDate):
+    # Fetch the tickers through the price cache and write them as a matrix.
+    # Returns the tickers that could not be fetched.
+    from DividendCache import cachedFetcher
+    from DividendFetch import fetchPrices
+    from DividendSources import sourceFetcher
+
+    priceRecords = {}
+    failed = []
+    for ticker, priceRecord in fetchPrices(tickers, beginDate, endDate,
+                                           fetcher = cachedFetcher(sourceFetcher())):
+        if priceRecord is None:
+            failed.append(ticker)
+        else:
+            priceRecords[ticker] = priceRecord
+    writePriceMatrix(path, dict((ticker, priceRecords[ticker]) for ticker in tickers
+                                if ticker in priceRecords))
+    return failed
+
+
+if __name__ == '__main__':
+    # DividendPriceMatrix.py path tickers.csv [tickers.csv ...]
+    # Builds path.npy and path.json for DIVIDEND_SOURCE=matrix:path
+    from DividendUniverse import loadBadTickers, readTickerList, unionTickers
+
+    if len(sys.argv) < 3:
+        print('usage: DividendPriceMatrix.py path tickers.csv [tickers.csv ...]')
+        sys.exit(1)
+    badTickers = loadBadTickers()
+    tickers = unionTickers([readTickerList(csvTickerFile, badTickers)
+                            for csvTickerFile in sys.argv[2:]])
+    endDate = datetime.now()
+    failed = buildPriceMatrix(sys.argv[1], tickers, endDate - timedelta(days = 365), endDate)
+    print(' {0} tickers in {1}.npy'.format(len(tickers) - len(failed), sys.argv[1]))
+    if failed:
+        print(' Left out {0} tickers: {1}'.format(len(failed), ', '.join(failed)))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+import csv
+import os
+from contextlib import contextmanager
+
+
+resultHeader = ['Ticker', 'Close', 'Boll Pct', 'Lower Bound', 'RSI', 'ROC', 'Count']
+
+# Further indicators from the registry in DividendIndicators, written as
+# extra columns after Count, e.g. ['SMA50', 'MACD', 'StochK', 'ATR']
+resultIndicators = []
+
+# Also write a Parquet copy next to every CSV result for downstream tools
+parquetCopies = False
+
+
+def writeTable(path, header, rows):
+    # Write the whole table to a temp file beside the target and move it
+    # into place, so readers never see a half written result file
+    tempPath = path + '.tmp'
+    try:
+        if path.endswith('.parquet'):
+            import pandas as pd
+            pd.DataFrame(rows, columns = header).to_parquet(tempPath, index = False)
+        else:
+            with open(tempPath, 'w', newline = '') as fileOut:
+                resultWriter = csv.writer(fileOut)
+                if header is not None:
+                    resultWriter.writerow(header)
+                resultWriter.writerows(rows)
+        os.replace(tempPath, path)
+    except:
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+        raise
+    return
+
+
+def resultColumns():
+    return resultHeader + resultIndicators
+
+
+def resultRow(ticker, values):
+    # One result row laid out as resultColumns() from a ticker's screened
+    # values, (close, bollPct, lowerBound, RSI, ROC, count, extras...)
+    close, bollPct, lowerBound, RSI, ROC, counter = values[:6]
+    return ([ticker, close, round(bollPct, 2), round(lowerBound, 2), round(RSI, 1),
+             round(ROC * 100, 1), counter] +
+            [round(value, 2) for value in values[6:6 + len(resultIndicators)]])
+
+
+@contextmanager
+def resultSink(path, header = None, signalSource = None):
+    # Collect result rows for one run and write them out once at the end.
+    # If the run fails part way the previous result file is left untouched.
+    # With a signalSource the rows are also kept in the signal history.
+    #
+    #     with resultSink('ChampionResultCCC.csv') as writeRow:
+    #         writeRow([ticker, close, ...])
+    header = header or resultColumns()
+    rows = []
+    yield rows.append
+    writeTable(path, header, rows)
+    if parquetCopies and path.endswith('.csv'):
+        writeTable(path[:-4] + '.parquet', header, rows)
+    if signalSource is not None:
+        from DividendSignals import storeSignals
+        storeSignals(signalSource, rows)
+    return
+
+
+@contextmanager
+def streamSink(path, header = None, signalSource = None):
+    # Like resultSink, but each chunk of rows goes straight out to the temp
+    # file, and to the signal history, so a run never holds more than one
+    # chunk. The file is still only moved into place once the run finishes.
+    #
+    #     with streamSink('ChampionResultCCC.csv') as writeRows:
+    #         writeRows([[ticker, close, ...], ...])
+    tempPath = path + '.tmp'
+    try:
+        with open(tempPath, 'w', newline = '') as fileOut:
+            resultWriter = csv.writer(fileOut)
+            resultWriter.writerow(header or resultColumns())
+
+            def writeRows(rows):
+                resultWriter.writerows(rows)
+                if signalSource is not None and rows:
+                    from DividendSignals import storeSignals
+                    storeSignals(signalSource, rows)
+            yield writeRows
+        os.replace(tempPath, path)
+    except:
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+        raise
+    if parquetCopies and path.endswith('.csv'):
+        import pandas as pd
+        pd.read_csv(path).to_parquet(path[:-4] + '.parquet', index = False)
+    return
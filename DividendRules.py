@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+
+import ast
+import operator
+import os
+import sys
+from functools import reduce
+import numpy as np
+from DividendIndicators import indicatorRegistry
+from DividendUniverse import (watchStatus, notWatched, addedStatus, waitingStatus,
+                              buyStatus, investigateStatus, statusCodes)
+
+
+# The watchlist rules are read from ruleFile when it exists. Each rule set
+# is named in brackets after the list it scores, and lists without their
+# own set use [default]. Every line under a name is one move
+#
+#     from statuses -> to status : condition
+#
+# where from is 'any', 'watched' or a comma separated list of statuses,
+# 'Not watched' takes a ticker off the watchlist, and the condition is a
+# Python style expression over registry indicators, in any case, e.g.
+#
+#     watched -> Buy : rsi > 30 and count == 0 and close > sma200
+#
+# A ticker takes the first line that matches it and keeps its status when
+# none does. Conditions are compiled into array expressions, so a rule set
+# scores a whole list, or a whole history, in a few array operations.
+ruleFile = 'DividendRules.txt'
+
+# The rules the scripts have always used
+defaultRules = '''
+[default]
+# all three oversold signals put a ticker on the watchlist
+any -> Added to watchlist : count == 3
+# a watched ticker waits while the RSI is still oversold
+watched -> Waiting for RSI : rsi < 30
+# once the RSI recovers a Buy comes off, the rest move on
+Buy -> Not watched : true
+watched -> Buy : count == 0
+watched -> Investigate : true
+'''
+
+# What the scripts print when a rule moves a ticker to each status
+statusMessages = {addedStatus : '{ticker} added to {source} watchlist',
+                  waitingStatus : '{source} {ticker} is waiting for RSI',
+                  buyStatus : '{source} {ticker} is a new buy',
+                  investigateStatus : '{source} {ticker} needs investigation'}
+
+compareOperators = {ast.Lt : operator.lt, ast.LtE : operator.le, ast.Gt : operator.gt,
+                    ast.GtE : operator.ge, ast.Eq : operator.eq, ast.NotEq : operator.ne}
+arithmeticOperators = {ast.Add : operator.add, ast.Sub : operator.sub,
+                       ast.Mult : operator.mul, ast.Div : operator.truediv}
+
+# (path, modified time) : rule sets, so a run parses the file once
+loadedRules = {}
+
+
+def compileNode(node, names):
+    # Turn one node of a condition into a function of {indicator : array},
+    # collecting the indicators it reads in names
+    if isinstance(node, ast.BoolOp):
+        parts = [compileNode(value, names) for value in node.values]
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        return lambda values: reduce(combine, [part(values) for part in parts])
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Not, ast.USub)):
+        operand = compileNode(node.operand, names)
+        if isinstance(node.op, ast.Not):
+            return lambda values: np.logical_not(operand(values))
+        return lambda values: -operand(values)
+    if isinstance(node, ast.Compare):
+        # a < b < c is (a < b) and (b < c)
+        terms = [compileNode(term, names) for term in [node.left] + node.comparators]
+        tests = []
+        for position, op in enumerate(node.ops):
+            if type(op) not in compareOperators:
+                break
+            tests.append((compareOperators[type(op)], terms[position], terms[position + 1]))
+        else:
+            return lambda values: reduce(np.logical_and, [compare(left(values), right(values))
+                                                          for compare, left, right in tests])
+    if isinstance(node, ast.BinOp) and type(node.op) in arithmeticOperators:
+        combine = arithmeticOperators[type(node.op)]
+        left = compileNode(node.left, names)
+        right = compileNode(node.right, names)
+        return lambda values: combine(left(values), right(values))
+    if isinstance(node, ast.Name):
+        if node.id.lower() in ('true', 'false'):
+            constant = node.id.lower() == 'true'
+            return lambda values: constant
+        registryNames = dict((name.lower(), name) for name in indicatorRegistry)
+        if node.id.lower() not in registryNames:
+            raise ValueError('unknown indicator ' + repr(node.id))
+        name = registryNames[node.id.lower()]
+        if name not in names:
+            names.append(name)
+        return lambda values: values[name]
+    if (isinstance(node, ast.Constant) and isinstance(node.value, (int, float))
+            and not isinstance(node.value, bool)):
+        return lambda values: node.value
+    raise ValueError('cannot use {0!r} in a rule'.format(ast.unparse(node)))
+
+
+def compileCondition(condition):
+    # (function of {indicator : array} giving a mask, indicators it reads)
+    try:
+        tree = ast.parse(condition.strip(), mode = 'eval')
+    except SyntaxError:
+        raise ValueError('cannot read condition ' + repr(condition.strip()))
+    names = []
+    return compileNode(tree.body, names), names
+
+
+def statusCode(name):
+    name = name.strip()
+    if name.lower() == 'not watched':
+        return notWatched
+    if name not in statusCodes:
+        raise ValueError('unknown status ' + repr(name))
+    return statusCodes[name]
+
+
+def compileRule(fromPart, toPart, condition):
+    fromPart = fromPart.strip()
+    if fromPart.lower() in ('any', 'watched'):
+        fromStatuses = fromPart.lower()
+    else:
+        fromStatuses = tuple(statusCode(name) for name in fromPart.split(','))
+    test, names = compileCondition(condition)
+    return {'from' : fromStatuses, 'to' : statusCode(toPart), 'when' : condition.strip(),
+            'test' : test, 'indicators' : names}
+
+
+def parseRules(text, source = ruleFile):
+    # {rule set name : [rule]} in file order
+    ruleSets = {}
+    rules = None
+    for lineNumber, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            if line.startswith('[') and line.endswith(']'):
+                rules = ruleSets.setdefault(line[1:-1].strip(), [])
+                continue
+            if rules is None:
+                raise ValueError('rule before the first [rule set]')
+            move, condition = line.split(':', 1)
+            fromPart, toPart = move.split('->')
+            rules.append(compileRule(fromPart, toPart, condition))
+        except ValueError as err:
+            raise ValueError('{0} line {1}: {2}'.format(source, lineNumber, err))
+    return ruleSets
+
+
+def loadRules(path = None):
+    # The rule sets of the rules file, or the default rules without one.
+    # The file is parsed again only when it changes.
+    path = path or ruleFile
+    modified = os.path.getmtime(path) if os.path.exists(path) else None
+    if (path, modified) not in loadedRules:
+        if modified is None:
+            ruleSets = parseRules(defaultRules, 'defaultRules')
+        else:
+            with open(path, 'r') as fileIn:
+                ruleSets = parseRules(fileIn.read(), path)
+            if 'default' not in ruleSets:
+                ruleSets['default'] = parseRules(defaultRules, 'defaultRules')['default']
+        loadedRules[(path, modified)] = ruleSets
+    return loadedRules[(path, modified)]
+
+
+def ruleSetFor(descriptor, path = None):
+    ruleSets = loadRules(path)
+    return ruleSets.get(descriptor, ruleSets['default'])
+
+
+def ruleIndicators(ruleSets = None):
+    # Every registry indicator some rule reads
+    names = []
+    for rules in (ruleSets or loadRules()).values():
+        for rule in rules:
+            names.extend(name for name in rule['indicators'] if name not in names)
+    return names
+
+
+def ruleConditions(rules, values):
+    # One mask per rule over arrays of any shape, a list of tickers or a
+    # days x tickers history. Rules with the same condition share a mask.
+    masks = {}
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        for rule in rules:
+            if rule['when'] not in masks:
+                masks[rule['when']] = rule['test'](values)
+    return [masks[rule['when']] for rule in rules]
+
+
+def applyRules(rules, status, conditions):
+    # Move every ticker by the first rule that matches it. Returns the new
+    # status codes and the index of the rule each ticker took, -1 for none.
+    newStatus = status.copy()
+    matched = np.full(status.shape, -1)
+    pending = np.ones(status.shape, dtype = bool)
+    for index, (rule, condition) in enumerate(zip(rules, conditions)):
+        if rule['from'] == 'any':
+            hit = pending & condition
+        elif rule['from'] == 'watched':
+            hit = pending & (status != notWatched) & condition
+        else:
+            hit = pending & np.isin(status, rule['from']) & condition
+        newStatus[hit] = rule['to']
+        matched[hit] = index
+        pending &= ~hit
+    return newStatus, matched
+
+
+def watchlistMoves(rules, tickers, watch, screened):
+    # Run the rules over the scored tickers of one list at once. watch is
+    # updated in place in list order, and the (ticker, status) of every
+    # ticker a rule matched is returned for reporting.
+    from DividendState import screenedColumns
+
+    columns = screenedColumns()
+    table = np.array([screened[ticker][:len(columns)] for ticker in tickers],
+                     dtype = float).reshape(len(tickers), len(columns))
+    values = dict((name, table[:, column]) for column, name in enumerate(columns))
+    status = np.array([watch.get(ticker, notWatched) for ticker in tickers], dtype = np.int8)
+    newStatus, matched = applyRules(rules, status, ruleConditions(rules, values))
+
+    moves = []
+    for position in np.flatnonzero(matched >= 0):
+        ticker = tickers[position]
+        code = int(newStatus[position])
+        if code == notWatched:
+            watch.pop(ticker, None)
+        else:
+            watch[ticker] = code
+        moves.append((ticker, code))
+    return moves
+
+
+if __name__ == '__main__':
+    # DividendRules.py [rules.txt]   check a rules file and list its rule sets
+    ruleSets = loadRules(sys.argv[1] if len(sys.argv) > 1 else None)
+    for name, rules in ruleSets.items():
+        print(' [{0}]'.format(name))
+        for rule in rules:
+            fromStatuses = rule['from']
+            if not isinstance(fromStatuses, str):
+                fromStatuses = ', '.join(watchStatus[code] for code in fromStatuses)
+            print('   {0} -> {1} : {2}'.format(fromStatuses, watchStatus[rule['to']] or
+                                               'Not watched', rule['when']))
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+import csv
+import os
+import subprocess
+import sys
+import zlib
+from DividendCheckpoint import loadCheckpoint, saveCheckpoint, clearCheckpoint
+from datetime import datetime, timedelta
+from DividendMetrics import startRun, finishRun, timeStage
+from DividendPriceMatrix import buildPriceMatrix
+from DividendResults import resultColumns, writeTable
+from DividendState import screenTickers
+from DividendTickersCCC import cccFileSets, main, whenIsNow
+from DividendUniverse import (loadBadTickers, loadDoubleDividends, readTickerList,
+                              unionTickers, loadWatchlist, writeWatchlist)
+
+
+# Partial result and watchlist files of each shard go here until merged
+shardDir = 'shards'
+
+
+# Every ticker belongs to exactly one of N shards, decided by a hash of the
+# symbol that is the same on every machine and every run. A shard screens
+# its tickers of each list and writes partial files. The merge puts the
+# partial files back together in list order, giving the same files as one
+# process would. The watchlist rules only ever look at one ticker, so each
+# shard can run them on its own part of the watchlist.
+
+
+def shardOf(ticker, shardCount):
+    return zlib.crc32(ticker.encode('utf-8')) % shardCount
+
+
+def shardPath(path, shard, shardCount, directory = None):
+    # ChampionResultCCC.csv -> shards/ChampionResultCCC.shard2of4.csv
+    base, extension = os.path.splitext(os.path.basename(path))
+    return os.path.join(directory or shardDir,
+                        '{0}.shard{1}of{2}{3}'.format(base, shard, shardCount, extension))
+
+
+def loadLists(fileSets):
+    with timeStage('loadLists'):
+        badTickers = loadBadTickers()
+        ddTickers = loadDoubleDividends()
+        tickerLists = [readTickerList(fileSet[0], badTickers) for fileSet in fileSets]
+    return tickerLists, ddTickers
+
+
+def runShard(shard, shardCount, directory = None, fileSets = cccFileSets):
+    # Screen this shard's tickers and write its partial files
+    directory = directory or shardDir
+    os.makedirs(directory, exist_ok = True)
+    tickerLists, ddTickers = loadLists(fileSets)
+    shardLists = [[ticker for ticker in tickerList if shardOf(ticker, shardCount) == shard]
+                  for tickerList in tickerLists]
+
+    checkpoint = loadCheckpoint('DividendTickersCCC.shard{0}of{1}'.format(shard, shardCount))
+    screened = screenTickers(unionTickers(shardLists), checkpoint)
+
+    for (csvTickerFile, csvResultFile, csvWatchlistFile, descriptor), tickerList in \
+            zip(fileSets, shardLists):
+        if descriptor in checkpoint['lists']:
+            continue
+        print(' ** Writing {0} shard {1} of {2} at'.format(descriptor, shard, shardCount),
+              whenIsNow(), ' **')
+
+        # the shard's part of the watchlist, still in file order
+        shardTickers = set(tickerList)
+        shardWatch = dict((ticker, status) for ticker, status in
+                          loadWatchlist(csvWatchlistFile).items() if ticker in shardTickers)
+
+        # each shard keeps its rows in the signal history under the merged
+        # result file, so the shards together fill in the whole list
+        with timeStage('watchlistAndResults'):
+            main(tickerList, shardWatch, descriptor,
+                 shardPath(csvResultFile, shard, shardCount, directory),
+                 shardPath(csvWatchlistFile, shard, shardCount, directory),
+                 screened, ddTickers, csvResultFile)
+        checkpoint['lists'][descriptor] = shardWatch
+        saveCheckpoint(checkpoint)
+    clearCheckpoint(checkpoint)
+    return
+
+
+def mergeShards(shardCount, directory = None, fileSets = cccFileSets):
+    # Combine the partial files of every shard into the real result files
+    # and watchlists, then remove the partial files. Nothing is written
+    # unless every shard has finished every list.
+    directory = directory or shardDir
+    tickerLists, _ = loadLists(fileSets)
+
+    missing = []
+    for csvTickerFile, csvResultFile, csvWatchlistFile, descriptor in fileSets:
+        for shard in range(shardCount):
+            for path in (csvResultFile, csvWatchlistFile):
+                if not os.path.exists(shardPath(path, shard, shardCount, directory)):
+                    missing.append(shardPath(path, shard, shardCount, directory))
+    if missing:
+        raise IOError('shards not finished: ' + ', '.join(missing))
+
+    for (csvTickerFile, csvResultFile, csvWatchlistFile, descriptor), tickerList in \
+            zip(fileSets, tickerLists):
+        print(' ** Merging {0} at'.format(descriptor), whenIsNow(), ' **')
+        position = dict((ticker, index) for index, ticker in enumerate(tickerList))
+        partialFiles = []
+
+        # result rows back in list order
+        rows = []
+        for shard in range(shardCount):
+            partialFile = shardPath(csvResultFile, shard, shardCount, directory)
+            partialFiles.append(partialFile)
+            with open(partialFile, 'r', newline = '') as fileIn:
+                partialReader = csv.reader(fileIn)
+                next(partialReader)
+                rows.extend(partialReader)
+        rows.sort(key = lambda row: position[row[0]])
+        writeTable(csvResultFile, resultColumns(), rows)
+
+        # Tickers on the watchlist but outside the list were not touched by
+        # any shard. The rest take their shard's status in place, or drop
+        # off, and new entries follow in list order as main() adds them.
+        shardWatch = {}
+        for shard in range(shardCount):
+            partialFile = shardPath(csvWatchlistFile, shard, shardCount, directory)
+            partialFiles.append(partialFile)
+            shardWatch.update(loadWatchlist(partialFile))
+        watch = {}
+        for ticker, status in loadWatchlist(csvWatchlistFile).items():
+            if ticker not in position:
+                watch[ticker] = status
+            elif ticker in shardWatch:
+                watch[ticker] = shardWatch.pop(ticker)
+        for ticker in sorted(shardWatch, key = position.get):
+            watch[ticker] = shardWatch[ticker]
+        writeWatchlist(csvWatchlistFile, watch)
+
+        for partialFile in partialFiles:
+            os.remove(partialFile)
+    return
+
+
+def runLocal(shardCount, directory = None, fileSets = cccFileSets):
+    # Run every shard as its own process on this machine, then merge. The
+    # prices are fetched once here and the shards read them from a shared
+    # memory mapped matrix.
+    directory = directory or shardDir
+    os.makedirs(directory, exist_ok = True)
+    tickerLists, _ = loadLists(fileSets)
+    matrixPath = os.path.join(directory, 'prices')
+    endDate = datetime.now()
+    with timeStage('fetch'):
+        buildPriceMatrix(matrixPath, unionTickers(tickerLists),
+                         endDate - timedelta(days = 365), endDate)
+
+    environment = dict(os.environ, DIVIDEND_SOURCE = 'matrix:' + matrixPath)
+    command = [sys.executable, os.path.abspath(__file__), 'run']
+    shards = [subprocess.Popen(command + [str(shard), str(shardCount), directory],
+                               env = environment)
+              for shard in range(shardCount)]
+    failed = [shard for shard, process in enumerate(shards) if process.wait() != 0]
+    if failed:
+        raise RuntimeError('shards {0} failed'.format(failed))
+    mergeShards(shardCount, directory)
+    for extension in ('.npy', '.json'):
+        os.remove(matrixPath + extension)
+    return
+
+
+if __name__ == '__main__':
+    # DividendShards.py run SHARD COUNT [dir]   screen one shard, e.g. on one host
+    # DividendShards.py merge COUNT [dir]       combine the finished shards
+    # DividendShards.py local COUNT [dir]       run COUNT shards here, then merge
+    if len(sys.argv) > 3 and sys.argv[1] == 'run':
+        profiler = startRun()
+        shard, shardCount = int(sys.argv[2]), int(sys.argv[3])
+        runShard(shard, shardCount, sys.argv[4] if len(sys.argv) > 4 else None)
+        finishRun('DividendShards.shard{0}of{1}'.format(shard, shardCount), profiler)
+    elif len(sys.argv) > 2 and sys.argv[1] in ('merge', 'local'):
+        profiler = startRun()
+        shardCount = int(sys.argv[2])
+        if sys.argv[1] == 'merge':
+            mergeShards(shardCount, sys.argv[3] if len(sys.argv) > 3 else None)
+        else:
+            runLocal(shardCount, sys.argv[3] if len(sys.argv) > 3 else None)
+        finishRun('DividendShards', profiler)
+    else:
+        print('usage: DividendShards.py run SHARD COUNT [dir] | merge COUNT [dir] | '
+              'local COUNT [dir]')
+        sys.exit(1)
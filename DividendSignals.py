@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+import os
+import sys
+from datetime import date, timedelta
+from DividendCache import cacheFile, openCache
+
+
+# Every result row of every run is kept in the signals table, one row per
+# ticker, bar date and result file. The primary key answers a ticker's
+# history and the date and count indexes answer questions across the
+# universe.
+signalColumns = ['ticker', 'date', 'source', 'close', 'bollPct', 'lowerBound',
+                 'RSI', 'ROC', 'count']
+
+
+def openSignalStore(path = None):
+    connection = openCache(path)
+    connection.execute('CREATE TABLE IF NOT EXISTS signals ('
+                       'ticker TEXT NOT NULL, date TEXT NOT NULL, source TEXT NOT NULL, '
+                       'close REAL, bollPct REAL, lowerBound REAL, RSI REAL, ROC REAL, '
+                       'count INTEGER, PRIMARY KEY (ticker, date, source))')
+    connection.execute('CREATE INDEX IF NOT EXISTS signalDate ON signals (date)')
+    connection.execute('CREATE INDEX IF NOT EXISTS signalCount ON signals (count, date)')
+    return connection
+
+
+def storeSignals(source, rows, runDate = None, path = None):
+    # Keep one run's result rows, laid out as resultHeader, under the date
+    # of the bar each ticker was scored on, which is the newest bar in its
+    # saved indicator state. A rerun before the next bar, say on a weekend,
+    # replaces those rows instead of adding a copy. runDate only stands in
+    # for a ticker without a saved state.
+    from DividendState import openStateStore, loadStates
+
+    runDate = (runDate or date.today()).strftime('%Y-%m-%d')
+    connection = openStateStore(path)
+    try:
+        states = loadStates(connection, [row[0] for row in rows])
+    finally:
+        connection.close()
+    barDates = dict((ticker, state['lastDate']) for ticker, state in states.items())
+
+    connection = openSignalStore(path)
+    try:
+        connection.executemany('INSERT OR REPLACE INTO signals VALUES '
+                               '(?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               [(row[0], barDates.get(row[0]) or runDate, source) +
+                                tuple(row[1:7]) for row in rows])
+        connection.commit()
+    finally:
+        connection.close()
+    return
+
+
+def querySignals(ticker = None, source = None, days = None, count = None, path = None):
+    # Rows of the signals table, oldest first, narrowed by any of
+    #     ticker   one ticker's history
+    #     source   one result file, e.g. 'ChampionResultCCC.csv'
+    #     days     bars within the last so many days
+    #     count    rows with this oversold count
+    #
+    #     querySignals(count = 3, days = 30)
+    #     querySignals(ticker = 'XOM')
+    conditions = []
+    values = []
+    if ticker is not None:
+        conditions.append('ticker = ?')
+        values.append(ticker)
+    if source is not None:
+        conditions.append('source = ?')
+        values.append(source)
+    if days is not None:
+        conditions.append('date >= ?')
+        values.append((date.today() - timedelta(days = days)).strftime('%Y-%m-%d'))
+    if count is not None:
+        conditions.append('count = ?')
+        values.append(count)
+
+    query = 'SELECT ' + ', '.join(signalColumns) + ' FROM signals'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY date, ticker, source'
+
+    connection = openSignalStore(path)
+    try:
+        return connection.execute(query, values).fetchall()
+    finally:
+        connection.close()
+
+
+def latestSignals(source, path = None):
+    # {ticker : row} with each ticker's newest row from one result file, or
+    # nothing if there is no store yet. Tickers are taken one by one since a
+    # stale ticker's last bar can be older than the rest of the list's.
+    if not os.path.exists(path or cacheFile):
+        return {}
+    connection = openSignalStore(path)
+    try:
+        rows = connection.execute('SELECT ' + ', '.join(signalColumns) + ' FROM signals AS s '
+                                  'WHERE source = ? AND date = '
+                                  '(SELECT MAX(date) FROM signals '
+                                  'WHERE ticker = s.ticker AND source = s.source)',
+                                  (source,)).fetchall()
+    finally:
+        connection.close()
+    return dict((row[0], row) for row in rows)
+
+
+if __name__ == '__main__':
+    # DividendSignals.py ticker XOM
+    # DividendSignals.py count 3 [days]
+    if len(sys.argv) > 2 and sys.argv[1] == 'ticker':
+        rows = querySignals(ticker = sys.argv[2])
+    elif len(sys.argv) > 2 and sys.argv[1] == 'count':
+        rows = querySignals(count = int(sys.argv[2]),
+                            days = int(sys.argv[3]) if len(sys.argv) > 3 else 30)
+    else:
+        print('usage: DividendSignals.py ticker SYMBOL | count N [days]')
+        sys.exit(1)
+
+    print(' '.join('{0:>12}'.format(column) for column in signalColumns))
+    for row in rows:
+        print(' '.join('{0:>12}'.format(value) for value in row))
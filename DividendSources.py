@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+import os
+import time
+
+
+# Every script gets its prices from this source unless told otherwise:
+#   google, yahoo, stooq   pandas_datareader, one request per symbol list
+#   dir:<path>             <path>/<TICKER>.csv or .parquet files
+#   replay:<path>          the same as dir, for a directory made by record
+#   record:<path>[,source] fetch from source (default google) and keep a copy
+#   matrix:<path>          a price matrix built by DividendPriceMatrix
+#   stub[:latency[,days]]  synthetic prices, no network at all
+dataSource = os.environ.get('DIVIDEND_SOURCE', 'google')
+
+# pandas_datareader sources that accept a list of symbols in one call
+bulkSources = ('google', 'yahoo', 'stooq')
+
+
+def readerFetcher(source):
+    # A fetcher backed by pandas_datareader. Sources that take a symbol list
+    # also get a bulkFetch that returns {ticker: priceRecord}, leaving out
+    # any symbol the source could not find.
+    def fetcher(ticker, beginDate, endDate):
+        import pandas_datareader as pdr
+        return pdr.DataReader(ticker, source, beginDate, endDate)
+
+    def bulkFetch(tickers, beginDate, endDate):
+        import pandas_datareader as pdr
+        if len(tickers) == 1:
+            return {tickers[0] : fetcher(tickers[0], beginDate, endDate)}
+        priceRecords = pdr.DataReader(list(tickers), source, beginDate, endDate)
+        found = set(priceRecords.columns.get_level_values('Symbols'))
+        return dict((ticker, priceRecords.xs(ticker, axis = 1, level = 'Symbols').dropna(how = 'all'))
+                    for ticker in tickers if ticker in found)
+
+    if source in bulkSources:
+        fetcher.bulkFetch = bulkFetch
+    return fetcher
+
+
+googleFetcher = readerFetcher('google')
+
+
+def readRecordFile(directory, ticker):
+    # Load a ticker's saved bars, oldest first, or None if there are none
+    import pandas as pd
+
+    for extension in ('.parquet', '.csv'):
+        recordPath = os.path.join(directory, ticker + extension)
+        if os.path.exists(recordPath):
+            if extension == '.parquet':
+                priceRecord = pd.read_parquet(recordPath)
+            else:
+                priceRecord = pd.read_csv(recordPath, index_col = 0, parse_dates = True,
+                                          float_precision = 'round_trip')
+            priceRecord.index.name = 'Date'
+            return priceRecord.sort_index()
+    return None
+
+
+def directoryFetcher(directory):
+    # Serve prices from files on disk, with no network at all
+    def fetcher(ticker, beginDate, endDate):
+        priceRecord = readRecordFile(directory, ticker)
+        if priceRecord is None:
+            raise IOError('no saved prices for {0} in {1}'.format(ticker, directory))
+        return priceRecord[beginDate.strftime('%Y-%m-%d'):endDate.strftime('%Y-%m-%d')]
+
+    return fetcher
+
+
+def recordFetcher(fetcher, directory):
+    # Pass every request through to fetcher and merge what comes back into
+    # <directory>/<TICKER>.csv, so a later run can replay it offline
+    import pandas as pd
+
+    os.makedirs(directory, exist_ok = True)
+
+    def record(ticker, priceRecord):
+        savedRecord = readRecordFile(directory, ticker)
+        if savedRecord is not None:
+            priceRecord = pd.concat([savedRecord, priceRecord])
+            priceRecord = priceRecord[~priceRecord.index.duplicated(keep = 'last')]
+        priceRecord.sort_index().to_csv(os.path.join(directory, ticker + '.csv'))
+        return
+
+    def recorder(ticker, beginDate, endDate):
+        priceRecord = fetcher(ticker, beginDate, endDate)
+        record(ticker, priceRecord)
+        return priceRecord
+
+    def bulkRecorder(tickers, beginDate, endDate):
+        priceRecords = fetcher.bulkFetch(tickers, beginDate, endDate)
+        for ticker, priceRecord in priceRecords.items():
+            record(ticker, priceRecord)
+        return priceRecords
+
+    if hasattr(fetcher, 'bulkFetch'):
+        recorder.bulkFetch = bulkRecorder
+    return recorder
+
+
+def syntheticHistory(ticker, days, endDate):
+    # Deterministic daily OHLC bars for a ticker, a random walk seeded by
+    # the symbol so every run sees the same prices, with a dividend of
+    # 0.75% of the close about every three months
+    import numpy as np
+    import pandas as pd
+
+    seed = sum(ord(letter) * 31 ** i for i, letter in enumerate(ticker)) % 2 ** 32
+    generator = np.random.RandomState(seed)
+    closes = 50 * np.exp(np.cumsum(generator.normal(0, 0.015, days)))
+    opens = closes * np.exp(generator.normal(0, 0.005, days))
+    spread = np.abs(generator.normal(0, 0.01, days))
+    dates = pd.bdate_range(end = endDate, periods = days)
+    # The first bar of each 91 day block pays, so the payment dates do not
+    # move when the history is asked for over a different range
+    block = (dates.values.astype('datetime64[D]').astype(np.int64) + seed) // 91
+    paid = np.concatenate([[False], np.diff(block) > 0])
+    return pd.DataFrame({'Open' : opens,
+                         'High' : np.maximum(opens, closes) * (1 + spread),
+                         'Low' : np.minimum(opens, closes) * (1 - spread),
+                         'Close' : closes,
+                         'Volume' : generator.randint(10000, 1000000, days).astype(float),
+                         'Dividend' : np.where(paid, closes * 0.0075, 0.0)},
+                        index = dates)
+
+
+def stubFetcher(latency = 0.1, days = 250, failEvery = 0):
+    # Local data source for offline testing. Every request sleeps for the
+    # given latency and returns synthetic bars for the ticker.
+    # With failEvery = n, every n-th request raises to exercise retries.
+    callCount = [0]
+
+    def fetcher(ticker, beginDate, endDate):
+        callCount[0] += 1
+        if latency:
+            time.sleep(latency)
+        if failEvery and callCount[0] % failEvery == 0:
+            raise IOError('stub failure for ' + ticker)
+        return syntheticHistory(ticker, days, endDate)
+
+    return fetcher
+
+
+def sourceFetcher(source = None):
+    # Build the fetcher for a source name, see dataSource above
+    source = source or dataSource
+    kind, _, argument = source.partition(':')
+    if kind in ('dir', 'replay'):
+        return directoryFetcher(argument)
+    if kind == 'record':
+        directory, _, innerSource = argument.partition(',')
+        return recordFetcher(sourceFetcher(innerSource or 'google'), directory)
+    if kind == 'matrix':
+        from DividendPriceMatrix import matrixFetcher
+        return matrixFetcher(argument)
+    if kind == 'stub':
+        latency, _, days = argument.partition(',')
+        return stubFetcher(float(latency or 0.0), int(days or 250))
+    return readerFetcher(source)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+import json
+from datetime import datetime, timedelta
+import numpy as np
+from DividendCache import cachedFetcher, openCache
+from DividendCheckpoint import saveCheckpoint
+from DividendFetch import fetchBatches
+from DividendMetrics import countTicker, setTicker, timeStage
+from DividendIndicators import (bollWindow, rsiPeriod, rocPeriod, buildCloseMatrix,
+                                wilderAverages, relativeStrength, oversoldCount,
+                                latestIndicators, screenIndicators)
+from DividendResults import resultIndicators
+from DividendRules import ruleIndicators
+from DividendSources import sourceFetcher
+
+
+# Each ticker keeps enough state to roll its indicators forward one bar at
+# a time:
+#   lastDate, lastClose  the newest bar already folded in
+#   changeCount          number of price changes seen so far
+#   avgGain, avgLoss     Wilder averages (sum / 14 while still seeding)
+#   window               the last 20 closes, which also covers the 12 bar ROC
+#   windowSum, windowSumSq   running sums over the window for the Bollinger Bands
+
+
+def extraIndicators():
+    # Registry indicators scored after the six screen measures: the extra
+    # result columns, then anything else a watchlist rule reads
+    extras = list(resultIndicators)
+    extras.extend(name for name in ruleIndicators()
+                  if name not in screenIndicators and name not in extras)
+    return extras
+
+
+def screenedColumns():
+    # Names of the values in each screened tuple
+    return screenIndicators + extraIndicators()
+
+
+def openStateStore(path = None):
+    connection = openCache(path)
+    connection.execute('CREATE TABLE IF NOT EXISTS indicatorState ('
+                       'ticker TEXT PRIMARY KEY, state TEXT NOT NULL)')
+    return connection
+
+
+def loadStates(connection, tickers):
+    # One query per 900 tickers, under the 999 parameters older SQLite
+    # builds allow in one statement
+    states = {}
+    tickers = list(tickers)
+    for start in range(0, len(tickers), 900):
+        batch = tickers[start:start + 900]
+        rows = connection.execute('SELECT ticker, state FROM indicatorState WHERE ticker IN '
+                                  '({0})'.format(', '.join('?' * len(batch))), batch)
+        for ticker, state in rows:
+            states[ticker] = json.loads(state)
+    return states
+
+
+def saveStates(connection, states):
+    connection.executemany('INSERT OR REPLACE INTO indicatorState VALUES (?, ?)',
+                           [(ticker, json.dumps(state)) for ticker, state in states.items()])
+    connection.commit()
+    return
+
+
+def bootstrapStates(closeSeries, lastDates):
+    # Build the state for many tickers from their full histories in one
+    # batched pass over the close matrix
+    closeMatrix = buildCloseMatrix(closeSeries)
+    avgGain, avgLoss, validCount = wilderAverages(closeMatrix)
+
+    states = []
+    for column, lastDate in enumerate(lastDates):
+        window = closeMatrix[-bollWindow:, column]
+        window = [float(close) for close in window[~np.isnan(window)]]
+        states.append({'lastDate' : lastDate,
+                       'lastClose' : window[-1] if window else None,
+                       'changeCount' : int(validCount[column]),
+                       'avgGain' : float(avgGain[column]),
+                       'avgLoss' : float(avgLoss[column]),
+                       'window' : window,
+                       'windowSum' : sum(window),
+                       'windowSumSq' : sum(close * close for close in window)})
+    return states
+
+
+def updateState(state, date, close):
+    # Fold one new bar into the state in constant time
+    if state['lastClose'] is not None:
+        priceChange = close - state['lastClose']
+        gain = priceChange if priceChange > 0 else 0.0
+        loss = -priceChange if priceChange < 0 else 0.0
+        if state['changeCount'] < rsiPeriod:
+            # still building the first average
+            state['avgGain'] += gain / rsiPeriod
+            state['avgLoss'] += loss / rsiPeriod
+        else:
+            state['avgGain'] = (state['avgGain'] * (rsiPeriod - 1) + gain) / rsiPeriod
+            state['avgLoss'] = (state['avgLoss'] * (rsiPeriod - 1) + loss) / rsiPeriod
+        state['changeCount'] += 1
+
+    # Slide the Bollinger window along by one close
+    window = state['window']
+    window.append(close)
+    state['windowSum'] += close
+    state['windowSumSq'] += close * close
+    if len(window) > bollWindow:
+        oldest = window.pop(0)
+        state['windowSum'] -= oldest
+        state['windowSumSq'] -= oldest * oldest
+
+    state['lastDate'] = date
+    state['lastClose'] = close
+    return state
+
+
+def stateIndicators(state):
+    # Turn a state back into the (close, bollPct, lowerBound, RSI, ROC, count)
+    # row used by the screen
+    window = state['window']
+    ma20day = state['windowSum'] / len(window)
+    st20day = max(state['windowSumSq'] / len(window) - ma20day * ma20day, 0.0) ** 0.5
+    lowerBound = ma20day - 2 * st20day
+    upperBound = ma20day + 2 * st20day
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        bollPct = np.float64(state['lastClose'] - lowerBound) / (upperBound - lowerBound) * 100
+
+    if state['changeCount'] < rsiPeriod:
+        RSI = 100.0
+    else:
+        RSI = float(relativeStrength(state['avgGain'], state['avgLoss']))
+
+    # ROC needs the close twelve trading days ago
+    if state['changeCount'] > rocPeriod:
+        ROC = state['lastClose'] / window[-1 - rocPeriod] - 1
+    else:
+        ROC = 0.0
+
+    counter = int(oversoldCount(bollPct, RSI, ROC))
+    return (state['lastClose'], bollPct, lowerBound, RSI, ROC, counter)
+
+
+def advanceStates(tickers, priceRecords, states):
+    # Fold only the bars that arrived since the last run into each state.
+    # Tickers with no usable state, or whose stored last bar no longer
+    # matches the data, are rebuilt from their history in one batch.
+    rebuildTickers = []
+    for ticker in tickers:
+        state = states.get(ticker)
+        if state is None or state['lastDate'] is None:
+            rebuildTickers.append(ticker)
+            continue
+        # Find the stored last bar by bisection and look only at it and the
+        # bars after it, never the whole history
+        days = priceRecords[ticker].index.values.astype('datetime64[D]')
+        closes = priceRecords[ticker]['Close'].to_numpy(dtype = float)
+        lastDay = np.datetime64(state['lastDate'], 'D')
+        position = int(np.searchsorted(days, lastDay))
+        if (position == len(days) or days[position] != lastDay or
+                closes[position] != state['lastClose']):
+            rebuildTickers.append(ticker)
+            continue
+        for date, close in zip(np.datetime_as_string(days[position + 1:]).tolist(),
+                               closes[position + 1:].tolist()):
+            updateState(state, date, close)
+        setTicker(ticker, 'indicatorPath', 'incremental')
+        countTicker(ticker, 'newBars', len(days) - position - 1)
+
+    if rebuildTickers:
+        lastDates = []
+        for ticker in rebuildTickers:
+            index = priceRecords[ticker].index
+            lastDates.append(index[-1].strftime('%Y-%m-%d') if len(index) else None)
+        rebuilt = bootstrapStates([priceRecords[ticker].Close for ticker in rebuildTickers],
+                                  lastDates)
+        states.update(zip(rebuildTickers, rebuilt))
+        for ticker in rebuildTickers:
+            setTicker(ticker, 'indicatorPath', 'rebuild')
+    return states
+
+
+def scoreStates(tickers, priceRecords, states):
+    # Roll each ticker's state forward to the newest bar in priceRecords and
+    # score it. states is updated in place, so a caller that keeps it in
+    # memory, such as the daemon, skips the state store between refreshes.
+    advanceStates(tickers, priceRecords, states)
+    screened = {}
+    for ticker in tickers:
+        if states[ticker]['window']:
+            screened[ticker] = stateIndicators(states[ticker])
+
+    # Extra result columns and indicators the rules read come from the
+    # indicator registry, all of them in one pass over the batch's prices
+    extras = extraIndicators()
+    if extras:
+        scored = [ticker for ticker in tickers if ticker in screened]
+        latest = latestIndicators([priceRecords[ticker] for ticker in scored], extras)
+        for column, ticker in enumerate(scored):
+            screened[ticker] += tuple(float(latest[name][column]) for name in extras)
+    return screened
+
+
+def screenRecords(tickers, priceRecords, path = None):
+    # Score each ticker from its saved state, rolled forward to the newest
+    # bar in priceRecords, and save the updated state for the next run
+    connection = openStateStore(path)
+    try:
+        with timeStage('loadState'):
+            states = loadStates(connection, tickers)
+        with timeStage('indicators'):
+            screened = scoreStates(tickers, priceRecords, states)
+        with timeStage('saveState'):
+            saveStates(connection, states)
+    finally:
+        connection.close()
+    return screened
+
+
+def screenTickers(tickers, checkpoint = None):
+    # Fetch and score every ticker once, returning the technical measures
+    # keyed by ticker so several lists can share one pass. A ticker that
+    # cannot be fetched is left out instead of stopping the run, and with a
+    # checkpoint the scores are saved batch by batch so a rerun skips them.
+    beginDate = datetime.now() - timedelta(days = 365)
+    # Sort the ending date to today
+    endDate = datetime.now()
+    fetcher = cachedFetcher(sourceFetcher())
+
+    screened = checkpoint['screened'] if checkpoint is not None else {}
+    leftOut = []
+    for fetchedRecords in fetchBatches([ticker for ticker in tickers if ticker not in screened],
+                                       beginDate, endDate, fetcher, leftOut):
+        # Bollinger Bands, RSI and 12-day Rate of Change, rolled forward from
+        # the saved per-ticker state so only new bars cost anything
+        screened.update(screenRecords(list(fetchedRecords), fetchedRecords))
+        if checkpoint is not None:
+            saveCheckpoint(checkpoint)
+
+    if checkpoint is not None:
+        checkpoint['failed'] = leftOut
+        saveCheckpoint(checkpoint)
+    return screened
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+import os
+import sys
+from DividendSignals import latestSignals
+from DividendUniverse import cccFileSets, watchStatus, statusCodes, loadWatchlist, watchedWith
+
+
+# Today's watchlist status from the files the last run left behind: the
+# watchlists and the signal history. Only csv and sqlite3 are needed, so
+# this answers in a fraction of the time a full screen takes to import
+# pandas, numpy and matplotlib, and is cheap to call from cron or a loop.
+
+# (csvWatchlistFile, csvResultFile, descriptor) of every watchlist the
+# scripts keep; the signal history is kept per result file
+watchlistFiles = ([(fileSet[2], fileSet[1], fileSet[3]) for fileSet in cccFileSets] +
+                  [('ChampionWatchlist.csv', 'ChampionResult.csv', 'DividendChampions'),
+                   ('PaycheckWatchlist.csv', 'PaycheckResult.csv', 'DailyPaycheck')])
+
+
+def watchlistStatus(csvWatchlistFile, csvResultFile, statuses = None):
+    # [(ticker, status, latest signal row or None)] in watchlist order,
+    # only for the given status names if any are given
+    watch = loadWatchlist(csvWatchlistFile)
+    if statuses:
+        wanted = watchedWith(watch, *[statusCodes[name] for name in statuses
+                                      if name in statusCodes])
+        watch = dict((ticker, code) for ticker, code in watch.items() if ticker in wanted)
+    signals = latestSignals(csvResultFile)
+    return [(ticker, watchStatus[code], signals.get(ticker)) for ticker, code in watch.items()]
+
+
+if __name__ == '__main__':
+    # DividendStatus.py [status ...]   e.g. DividendStatus.py Buy Investigate
+    statuses = sys.argv[1:]
+    for csvWatchlistFile, csvResultFile, descriptor in watchlistFiles:
+        if not os.path.exists(csvWatchlistFile):
+            continue
+        print(' {0} ({1})'.format(descriptor, csvWatchlistFile))
+        for ticker, status, signal in watchlistStatus(csvWatchlistFile, csvResultFile, statuses):
+            if signal is None:
+                print('   {0:<20} {1:<6}'.format(status, ticker))
+            else:
+                print('   {0:<20} {1:<6} {2}  close {3:9.2f}  RSI {4:5.1f}  count {5}'.format(
+                        status, ticker, signal[1], signal[3], signal[6], signal[8]))
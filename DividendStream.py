@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+import gc
+from datetime import datetime, timedelta
+from DividendCache import cachedFetcher
+from DividendCheckpoint import saveCheckpoint
+from DividendFetch import fetchBatches
+from DividendIndicators import indicatorFields
+from DividendMetrics import residentMegabytes, timeStage
+from DividendResults import resultRow, streamSink
+from DividendRules import ruleSetFor, statusMessages, watchlistMoves
+from DividendSources import sourceFetcher
+from DividendState import extraIndicators, screenRecords
+from DividendUniverse import loadWatchlist, writeWatchlist
+
+
+# Streaming mode screens one list at a time in chunks of tickers. Each
+# chunk is fetched, scored, written out to the result file and run through
+# the watchlist rules, then dropped, so memory follows the chunk size and
+# not the size of the universe. Results, watchlists and messages come out
+# the same as in the batched mode.
+
+# Most tickers in one chunk
+streamChunk = 200
+
+# Soft cap on resident memory in MB. Chunks halve while the process is
+# near the cap and grow back once it is well under.
+streamMemoryMB = 512
+
+
+def nextChunkSize(chunkSize):
+    used = residentMegabytes()
+    if used > streamMemoryMB:
+        gc.collect()
+        used = residentMegabytes()
+    if used > streamMemoryMB * 0.9:
+        if chunkSize == 1:
+            print(' {0:.0f} MB resident is over the {1} MB cap even one ticker at a time'.format(
+                    used, streamMemoryMB), flush = True)
+        return max(chunkSize // 2, 1)
+    if used < streamMemoryMB * 0.5:
+        return min(chunkSize * 2, streamChunk)
+    return chunkSize
+
+
+def fetchChunk(chunk, fetcher, beginDate, endDate, fields):
+    # {ticker : priceRecord} of the chunk holding only the columns the
+    # indicators read, with failed tickers retried as in screenTickers
+    fetchedRecords = {}
+    for batchRecords in fetchBatches(chunk, beginDate, endDate, fetcher, [],
+                                     batchSize = len(chunk)):
+        for ticker, priceRecord in batchRecords.items():
+            fetchedRecords[ticker] = priceRecord[[field for field in fields
+                                                  if field in priceRecord]]
+    return fetchedRecords
+
+
+def streamList(fileSet, tickerList, ddTickers):
+    # Screen one list chunk by chunk in list order and write its files
+    from DividendTickersCCC import whenIsNow
+
+    csvTickerFile, csvResultFile, csvWatchlistFile, descriptor = fileSet
+    print(' ** Streaming {0} at'.format(descriptor), whenIsNow(), ' **')
+    beginDate = datetime.now() - timedelta(days = 365)
+    endDate = datetime.now()
+    fetcher = cachedFetcher(sourceFetcher())
+    fields = ['Close'] + [field for field in indicatorFields(extraIndicators())
+                          if field != 'Close']
+    rules = ruleSetFor(descriptor)
+    watch = loadWatchlist(csvWatchlistFile)
+
+    chunkSize = streamChunk
+    start = 0
+    peak = residentMegabytes()
+    with streamSink(csvResultFile, signalSource = csvResultFile) as writeRows:
+        while start < len(tickerList):
+            chunk = tickerList[start:start + chunkSize]
+            start += len(chunk)
+            fetchedRecords = fetchChunk(chunk, fetcher, beginDate, endDate, fields)
+            scored = [ticker for ticker in chunk if ticker in fetchedRecords]
+            screened = screenRecords(scored, fetchedRecords)
+
+            with timeStage('watchlistAndResults'):
+                writeRows([resultRow(ticker, screened[ticker]) for ticker in scored])
+                for ticker, status in watchlistMoves(rules, scored, watch, screened):
+                    if status in statusMessages:
+                        print(statusMessages[status].format(ticker = ticker, source = descriptor) +
+                              ' DD = {0}'.format(ticker in ddTickers))
+            del fetchedRecords, screened
+            peak = max(peak, residentMegabytes())
+            chunkSize = nextChunkSize(chunkSize)
+
+    writeWatchlist(csvWatchlistFile, watch)
+    print(' {0} tickers, peak {1:.0f} MB resident'.format(len(tickerList), peak), flush = True)
+    return watch
+
+
+def streamLists(fileSets, tickerLists, ddTickers, checkpoint = None):
+    # A checkpoint only records finished lists here, since keeping every
+    # ticker's scores is what streaming avoids. A list stopped part way is
+    # screened again from the start; its files are not touched until done.
+    for fileSet, tickerList in zip(fileSets, tickerLists):
+        watch = streamList(fileSet, tickerList, ddTickers)
+        if checkpoint is not None:
+            checkpoint['lists'][fileSet[3]] = watch
+            saveCheckpoint(checkpoint)
+    return
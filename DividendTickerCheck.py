@@ -1,10 +1,20 @@
 #!/usr/bin/env python
 
-import csv
+import json
+import sys
 from datetime import datetime, timedelta
 from pytz import timezone
-import pandas_datareader as pdr
-import numpy as np
+from DividendCache import cachedFetcher
+from DividendFetch import fetchPrices
+from DividendSources import sourceFetcher
+from DividendMetrics import startRun, finishRun, timeStage, tickerMetrics
+from DividendResults import writeTable
+from DividendUniverse import badTickerFile, readTickerList
+
+
+# Calendar days to ask for when probing. 21 trading days for the Bollinger
+# check fit comfortably inside this even around holidays.
+probeDays = 45
 
 
 def whenIsNow():
@@ -12,16 +22,15 @@ def whenIsNow():
 
 
 def main():
+    import numpy as np
+
     # Load the bad tickers
-    badTickers = []
-    with open('DividendBadTickers.csv', 'r') as badFile:
-        tickerReader = csv.reader(badFile)
-        for symbol in tickerReader:
-            badTickers.extend(symbol)
+    badTickers = readTickerList(badTickerFile)
 
     # Set the date range
     beginDate = datetime.now() - timedelta(days = 365)
     endDate = datetime.now()
+    fetchPrice = cachedFetcher(sourceFetcher())
 
     # Loop through the ticker list
     for eachSymbol in badTickers:
@@ -32,8 +41,8 @@ def main():
         rocFlag = True
         # Check to see if the ticker exists at Google finance
         try:
-            priceRecord = pdr.DataReader(eachSymbol, 'google',
-                                         beginDate, endDate)
+            with timeStage('fetch', eachSymbol):
+                priceRecord = fetchPrice(eachSymbol, beginDate, endDate)
             priceRecordDF = priceRecord.iloc[::-1]
         except:
             print(' {0} ticker failure...'.format(eachSymbol), flush = True)
@@ -64,9 +73,77 @@ def main():
     return
 
 
+def checkHistory(priceRecord):
+    # Each length check on its own, so the report shows every failure
+    bbFlag = len(priceRecord.index) >= 21
+    rsiFlag = len(priceRecord.index) - 1 >= 14
+    rocFlag = len(priceRecord.index) >= 14
+    return bbFlag, rsiFlag, rocFlag
+
+
+def validateTickers(badTickers, workers = None):
+    # Probe every ticker at once over the shortest window the checks need.
+    # Prices already in the local cache are used without a network call.
+    endDate = datetime.now()
+    beginDate = endDate - timedelta(days = probeDays)
+    fetchPrice = cachedFetcher(sourceFetcher())
+
+    report = {}
+    for eachSymbol, priceRecord in fetchPrices(badTickers, beginDate, endDate,
+                                               fetcher = fetchPrice, workers = workers):
+        existFlag = priceRecord is not None and len(priceRecord.index) > 0
+        if existFlag:
+            bbFlag, rsiFlag, rocFlag = checkHistory(priceRecord)
+            bars = len(priceRecord.index)
+        else:
+            bbFlag, rsiFlag, rocFlag = False, False, False
+            bars = 0
+        report[eachSymbol] = {'Ticker' : eachSymbol, 'Exists' : existFlag,
+                              'Bollinger' : bbFlag, 'RSI' : rsiFlag, 'ROC' : rocFlag,
+                              'Good' : existFlag and bbFlag and rsiFlag and rocFlag,
+                              'Bars' : bars,
+                              'Seconds' : round(tickerMetrics.get(eachSymbol, {}).get('fetchSeconds', 0.0), 3)}
+    return [report[eachSymbol] for eachSymbol in badTickers if eachSymbol in report]
+
+
+def batchMain(reportFile, rewrite = False):
+    # Load the bad tickers
+    badTickers = readTickerList(badTickerFile)
+
+    report = validateTickers(badTickers)
+    for row in report:
+        if row['Good']:
+            print(' {0} is a good ticker'.format(row['Ticker']), flush = True)
+
+    # Write the machine readable report
+    if reportFile.endswith('.json'):
+        with open(reportFile, 'w') as fileOut:
+            json.dump(report, fileOut, indent = 2)
+    else:
+        header = ['Ticker', 'Exists', 'Bollinger', 'RSI', 'ROC', 'Good', 'Bars', 'Seconds']
+        writeTable(reportFile, header, [[row[column] for column in header] for row in report])
+
+    # Drop the good tickers from the bad ticker file
+    if rewrite:
+        goodTickers = set(row['Ticker'] for row in report if row['Good'])
+        writeTable(badTickerFile, None,
+                   [[eachSymbol] for eachSymbol in badTickers if eachSymbol not in goodTickers])
+        print(' Removed {0} tickers from DividendBadTickers.csv'.format(len(goodTickers)),
+              flush = True)
+    return
+
+
 if __name__ == '__main__':
     print('***** Beginning Dividend Ticker Status code at',
           whenIsNow(), ' *****', flush = True)
-    main()
+    profiler = startRun()
+    if '--batch' in sys.argv:
+        # DividendTickerCheck.py --batch [report.csv|report.json] [--rewrite]
+        reportArgs = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+        batchMain(reportArgs[0] if reportArgs else 'DividendTickerReport.csv',
+                  rewrite = '--rewrite' in sys.argv)
+    else:
+        main()
+    finishRun('DividendTickerCheck', profiler)
     print('***** Ending Dividend Ticker Status code at',
           whenIsNow(), ' *****', flush = True)
@@ -2,185 +2,154 @@
 
 from datetime import datetime, timedelta
 from pytz import timezone
-import numpy as np
-import csv
 import sys
-import pandas_datareader as pdr
+from DividendCache import cachedFetcher
+from DividendCheckpoint import (checkpointEvery, loadCheckpoint, saveCheckpoint,
+                                clearCheckpoint)
+from DividendFetch import retrySweeps
+from DividendSources import sourceFetcher
+from DividendMetrics import startRun, finishRun, timeStage
+from DividendPipeline import pipelineScreen
+from DividendResults import resultRow, resultSink
+from DividendRules import ruleSetFor, statusMessages, watchlistMoves
+from DividendState import screenTickers
+from DividendUniverse import (cccFileSets, loadBadTickers, loadDoubleDividends,
+                              readTickerList, unionTickers, loadWatchlist, writeWatchlist)
+
+
+def main(championTickers, champWatch, tickerSource, resultFile, watchlistFile,
+         screened = None, ddTickers = None, signalSource = None):
+    if ddTickers is None:
+        ddTickers = loadDoubleDividends()
+    if screened is None:
+        screened = screenTickers(championTickers)
+
+    # the result file is written in one go once every ticker is scored, and
+    # its rows kept in the signal history under the result file's name
+    scored = [ticker for ticker in championTickers if ticker in screened]
+    with resultSink(resultFile, signalSource = signalSource or resultFile) as writeRow:
+        # begin a loop through all of the tickers in dividend champions
+        for ticker in scored:
+            # append the ticker and technical measures to the result rows
+            writeRow(resultRow(ticker, screened[ticker]))
+
+    # the watchlist rules move the whole list at once
+    for ticker, status in watchlistMoves(ruleSetFor(tickerSource), scored, champWatch, screened):
+        if status in statusMessages:
+            # Find out if the ticket is a double dividend candidate
+            print(statusMessages[status].format(ticker = ticker, source = tickerSource) +
+                  ' DD = {0}'.format(ticker in ddTickers))
+    # write the watchlist
+    try:
+        writeWatchlist(watchlistFile, champWatch)
+    except:
+        print("Stopping at ticker: {0}".format(ticker))
 
+    return
 
-def main(championTickers, champWatch, tickerSource, resultFile, watchlistFile):
-    # Load in the double dividend tickers
-    ddTickers = []
 
-    # read the tickers from the csv file
-    with open(r'DoubleDividends.csv', 'r') as ddTickerFile:
-        ddTickerReader = csv.reader(ddTickerFile)
-        for symbol in ddTickerReader:
-            ddTickers.extend(symbol)
+def writeList(fileSet, tickerList, screened, ddTickers, checkpoint = None):
+    # Write one list's result file and watchlist from the scored tickers
+    csvTickerFile, csvResultFile, csvWatchlistFile, descriptor = fileSet
+    print(' ** Writing {0} at'.format(descriptor), whenIsNow(), ' **')
 
+    # load the watchlist
+    csvWatch = loadWatchlist(csvWatchlistFile)
+
+    with timeStage('watchlistAndResults'):
+        main(tickerList, csvWatch, descriptor, csvResultFile, csvWatchlistFile,
+             screened, ddTickers)
+    if checkpoint is not None:
+        checkpoint['lists'][descriptor] = csvWatch
+        saveCheckpoint(checkpoint)
+    return
+
+
+def pipelineLists(fileSets, tickerLists, allTickers, ddTickers, checkpoint = None):
+    # Download, score and write as overlapping stages. Each list is written
+    # as soon as all of its tickers are scored or given up on, while the
+    # tickers of later lists are still downloading.
     beginDate = datetime.now() - timedelta(days = 365)
-    # Sort the ending date to today
     endDate = datetime.now()
-
-    # begin a loop through all of the tickers in dividend champions
-    for ticker in championTickers:
-        # Find out if the ticket is a double dividend candidate
-        ddFlag = False
-        if ticker in ddTickers:
-            ddFlag = True
-        # grab the data from Google
-        try:
-            # price = finance.fetch_historical_yahoo(ticker, beginDate, endDate)
-            # price = pdr.get_data_yahoo(ticker, beginDate, endDate)
-            priceRecord = pdr.DataReader(ticker, 'google', beginDate, endDate)
-            priceRecordDF = priceRecord.iloc[::-1]
-        except:
-            print(ticker + ' failure...')
-            sys.exit(0)
-
-        # start with the 20-day moving average
-        ma20day = np.mean(priceRecordDF.Close[:20])
-        counter = 0
-
-        # Need to calculate Bollinger Bands and RSI and 12-day Rate of Change
-        # Bollinger Bands are 20-day SMA +/- 20-day standard deviation * 2
-        st20day = np.std(priceRecordDF.Close[:20])
-        lowerBound = ma20day - 2 * st20day
-        upperBound = ma20day + 2 * st20day
-        try:
-            bollPct = (priceRecordDF.Close[0] - lowerBound) / (upperBound - lowerBound) * 100
-        except:
-            print(ticker + ' Bollinger failure...')
-            sys.exit(0)
-        if bollPct < 0:
-            counter += 1
-
-        # RSI is multi-step
-        # First Average Gain = Sum of Gains over the Past 14 Periods / 14
-        # First Average Loss = Sum of Losses over the Past 14 Periods / 14
-        # Subsequent calculations are:
-        # Average Gain = [(previous average gain * 13) + current gain] / 14
-        # Average Loss = [(previous average loss * 13) + current loss] / 14
-        # RS = average gain / average loss
-        # RSI = 100 - 100 / (1 + RS)
-        priceChange = (np.diff(priceRecordDF.Close) * -1).tolist()
-        priceChange.reverse()
-
-        priceGain = 0.0
-        priceLoss = 0.0
-
-        if len(priceChange) > 13:
-            for i in range(14):
-                if priceChange[i] > 0:
-                    priceGain += priceChange[i]
-                    if priceChange[i] < 0:
-                        priceLoss += abs(priceChange[i])
-
-                        priceGain = priceGain / 14.0
-                        priceLoss = priceLoss / 14.0
-
-            for i in range(14, len(priceChange)):
-                if priceChange[i] > 0:
-                    priceGain = (priceGain * 13.0 + priceChange[i]) / 14.0
-                    priceLoss = (priceLoss * 13.0) / 14.0
-                else:
-                    priceGain = (priceGain * 13.0) / 14.0
-                    priceLoss = (priceLoss * 13.0 + abs(priceChange[i])) / 14.0
-
-            if priceLoss > 0:
-                RS = (priceGain / len(priceChange)) / (priceLoss / len(priceChange))
-                RSI = 100.0 - 100.0 / ( 1.0 + RS)
+    fetcher = cachedFetcher(sourceFetcher())
+
+    screened = checkpoint['screened'] if checkpoint is not None else {}
+    waitingLists = list(zip(fileSets, tickerLists))
+
+    def screenPass(pending, failed):
+        for batchScreened, batchFailed in pipelineScreen(pending, fetcher, beginDate,
+                                                         endDate, checkpointEvery):
+            for ticker in batchFailed:
+                print(ticker + ' failure...')
+            failed.extend(batchFailed)
+            yield batchScreened
+
+    leftOut = []
+    for batchScreened in retrySweeps([ticker for ticker in allTickers if ticker not in screened],
+                                     screenPass, leftOut):
+        screened.update(batchScreened)
+        if checkpoint is not None:
+            saveCheckpoint(checkpoint)
+
+        # write every list that has all of its tickers scored
+        stillWaiting = []
+        for fileSet, tickerList in waitingLists:
+            if all(ticker in screened for ticker in tickerList):
+                writeList(fileSet, tickerList, screened, ddTickers, checkpoint)
             else:
-                RSI = 100
+                stillWaiting.append((fileSet, tickerList))
+        waitingLists = stillWaiting
+
+    if checkpoint is not None:
+        checkpoint['failed'] = leftOut
+        saveCheckpoint(checkpoint)
+    # lists holding a ticker that was left out go last
+    for fileSet, tickerList in waitingLists:
+        writeList(fileSet, tickerList, screened, ddTickers, checkpoint)
+    return
 
-            if RSI < 30:
-                counter += 1
-        else:
-            RSI = 100
 
-        # ROC calculation is close divided by close twelve trading days ago
-        if len(priceRecordDF.index) > 13:
-            ROC = priceRecordDF.Close[0] / priceRecordDF.Close[12] - 1
-            if ROC < -.1:
-                counter += 1
+def processFiles(fileSets, checkpoint = None, pipeline = False, stream = False):
+    # Screen several ticker lists in one pass. Each entry of fileSets is
+    # (csvTickerFile, csvResultFile, csvWatchlistFile, descriptor). The
+    # union of the lists is fetched and scored once and then fanned out to
+    # each list's result file and watchlist. With a checkpoint, lists whose
+    # watchlist was already written are skipped, since running the
+    # watchlist rules twice would move tickers on a second step.
+    # With pipeline, lists are written while later tickers still download.
+    # With stream, each list is screened in chunks that are written out and
+    # dropped as they finish, for universes too large to hold at once.
+    with timeStage('loadLists'):
+        badTickers = loadBadTickers()
+        ddTickers = loadDoubleDividends()
+        tickerLists = [readTickerList(fileSet[0], badTickers) for fileSet in fileSets]
+
+    # build the union in list order so each ticker is only fetched once
+    allTickers = unionTickers(tickerLists)
+
+    todoSets = []
+    todoLists = []
+    for fileSet, tickerList in zip(fileSets, tickerLists):
+        if checkpoint is not None and fileSet[3] in checkpoint['lists']:
+            print(' ** {0} already written, skipping **'.format(fileSet[3]))
         else:
-            ROC = 0
-
-        # append the ticker and technical measures to csv file
-        with open(resultFile, 'a', newline = '') as fileOut:
-            champWriter = csv.writer(fileOut)
-            champWriter.writerow([ticker, priceRecordDF.Close[0],
-                        round(bollPct, 2), round(lowerBound, 2), round(RSI, 1),
-                        round(ROC * 100, 1), counter])
-        # if counter == 3, add ticker to watchlist
-        if counter == 3:
-            champWatch[ticker] = "Added to watchlist"
-            print("{0} added to {1} watchlist DD = {2}".format(ticker,
-                    tickerSource, ddFlag))
-        elif ticker in champWatch:
-            # with counter less than 3, check to see if RSI < 30
-            if RSI < 30:
-                champWatch[ticker] = "Waiting for RSI"
-                print("{0} {1} is waiting for RSI DD = {2}".format(tickerSource,
-                        ticker, ddFlag))
-            else:
-                # with RSI > 30
-                # if ticker in watchlist and value = "Buy" then remove
-                if ticker in champWatch:
-                    if champWatch[ticker] == "Buy":
-                        del champWatch[ticker]
-                    elif counter == 0:
-                        champWatch[ticker] = "Buy"
-                        print("{0} {1} is a new buy DD = {2}".format(tickerSource,
-                                ticker, ddFlag))
-                    else:
-                        champWatch[ticker] = "Investigate"
-                        print("{0} {1} needs investigation DD = {2}".format(tickerSource,
-                                ticker, ddFlag))
-    # write the watchlist
-    try:
-        with open(watchlistFile, 'w', newline='') as f:
-            w = csv.DictWriter(f, fieldnames = ['Ticker', 'Status'])
-            w.writeheader()
-            for i in champWatch.keys():
-                w.writerow({'Ticker' : i, 'Status' : champWatch[i]})
-    except:
-        print("Stopping at ticker: {0}".format(ticker))
-
+            todoSets.append(fileSet)
+            todoLists.append(tickerList)
+
+    if stream:
+        from DividendStream import streamLists
+        streamLists(todoSets, todoLists, ddTickers, checkpoint)
+    elif pipeline:
+        pipelineLists(todoSets, todoLists, allTickers, ddTickers, checkpoint)
+    else:
+        screened = screenTickers(allTickers, checkpoint)
+        for fileSet, tickerList in zip(todoSets, todoLists):
+            writeList(fileSet, tickerList, screened, ddTickers, checkpoint)
     return
 
 
-def processFile(csvTickerFile, csvResultFile, csvWatchlistFile, descriptor):
-    # create an empty list for the ticker symbols
-    tickerList = []
-
-    # Find the tickers without Google Finance data
-    badTickers = []
-    with open('DividendBadTickers.csv', 'r') as badFile:
-        tickerReader = csv.reader(badFile)
-        for symbol in tickerReader:
-            badTickers.extend(symbol)
-    
-    # read the tickers from the csv file
-    with open(csvTickerFile, 'r') as tickerFile:
-        tickerReader = csv.reader(tickerFile)
-        for symbol in tickerReader:
-            if symbol[0] not in badTickers:
-                tickerList.extend(symbol)
-
-    # create the new output file by only printing the headers
-    with open(csvResultFile, 'w', newline = '') as fileOut:
-        csvResultWriter = csv.writer(fileOut)
-        csvResultWriter.writerow(['Ticker', 'Close', 'Boll Pct', 'Lower Bound', 'RSI', 'ROC', 'Count'])
-
-    # load the watchlist
-    csvWatch = {}
-    with open(csvWatchlistFile, 'r') as watchlist:
-        reader = csv.DictReader(watchlist)
-        for row in reader:
-            csvWatch[row["Ticker"]] = row["Status"]
-
-    main(tickerList, csvWatch, descriptor, csvResultFile, csvWatchlistFile)
+def processFile(csvTickerFile, csvResultFile, csvWatchlistFile, descriptor, stream = False):
+    processFiles([(csvTickerFile, csvResultFile, csvWatchlistFile, descriptor)], stream = stream)
     return
 
 
@@ -190,13 +159,13 @@ def whenIsNow():
 
 if __name__ == '__main__':
     print('***** Beginning Dividend Tickers code at', whenIsNow(), ' *****')
-    print(' ** Beginning Dividend Champions at', whenIsNow(), ' **')
-    processFile('DividendChampion.csv', 'ChampionResultCCC.csv', \
-                'ChampionWatchlistCCC.csv', 'DividendChampions')
-    print(' ** Beginning Dividend Contenders at', whenIsNow(), ' **')
-    processFile('DividendContenders.csv', 'ContenderResultCCC.csv', \
-                'ContenderWatchlistCCC.csv', 'DividendContenders')
-    print(' ** Beginning Dividend Challengers at', whenIsNow(), ' **')
-    processFile('DividendChallengers.csv', 'ChallengerResultCCC.csv', \
-                'ChallengerWatchlistCCC.csv', 'DividendChallengers')
+    profiler = startRun()
+    # --pipeline writes each list while later tickers are still downloading
+    pipeline = '--pipeline' in sys.argv[1:]
+    # --stream screens in chunks with memory bounded by DividendStream settings
+    stream = '--stream' in sys.argv[1:]
+    checkpoint = loadCheckpoint('DividendTickersCCC')
+    processFiles(cccFileSets, checkpoint, pipeline, stream)
+    clearCheckpoint(checkpoint)
+    finishRun('DividendTickersCCC', profiler)
     print('***** Ending Dividend Tickers code at', whenIsNow(), ' *****')
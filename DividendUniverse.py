@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+import csv
+import sys
+from DividendResults import writeTable
+
+
+# Watchlist statuses are kept as small integer codes and only turned back
+# into names when a watchlist is written. Code 0 means off the watchlist.
+watchStatus = ['', 'Added to watchlist', 'Waiting for RSI', 'Buy', 'Investigate']
+notWatched, addedStatus, waitingStatus, buyStatus, investigateStatus = range(len(watchStatus))
+statusCodes = dict((name, code) for code, name in enumerate(watchStatus) if name)
+
+badTickerFile = 'DividendBadTickers.csv'
+doubleDividendFile = 'DoubleDividends.csv'
+watchlistHeader = ['Ticker', 'Status']
+
+# (csvTickerFile, csvResultFile, csvWatchlistFile, descriptor) of each CCC list
+cccFileSets = [('DividendChampion.csv', 'ChampionResultCCC.csv',
+                'ChampionWatchlistCCC.csv', 'DividendChampions'),
+               ('DividendContenders.csv', 'ContenderResultCCC.csv',
+                'ContenderWatchlistCCC.csv', 'DividendContenders'),
+               ('DividendChallengers.csv', 'ChallengerResultCCC.csv',
+                'ChallengerWatchlistCCC.csv', 'DividendChallengers')]
+
+
+def readTickerList(csvTickerFile, exclude = frozenset()):
+    # The tickers of a csv file in file order, each once, leaving out any
+    # in the exclude set. Symbols are interned so the many dicts and sets
+    # keyed by ticker share one string per symbol.
+    tickerList = []
+    seenTickers = set(exclude)
+    with open(csvTickerFile, 'r') as tickerFile:
+        for symbol in csv.reader(tickerFile):
+            for ticker in symbol:
+                if ticker and ticker not in seenTickers:
+                    seenTickers.add(ticker)
+                    tickerList.append(sys.intern(ticker))
+    return tickerList
+
+
+def loadBadTickers():
+    # Find the tickers without Google Finance data
+    return frozenset(readTickerList(badTickerFile))
+
+
+def loadDoubleDividends():
+    # Load in the double dividend tickers
+    return frozenset(readTickerList(doubleDividendFile))
+
+
+def unionTickers(tickerLists):
+    # Every ticker of the lists once, in list order
+    allTickers = []
+    seenTickers = set()
+    for tickerList in tickerLists:
+        for ticker in tickerList:
+            if ticker not in seenTickers:
+                seenTickers.add(ticker)
+                allTickers.append(ticker)
+    return allTickers
+
+
+def loadWatchlist(csvWatchlistFile):
+    # {ticker : status code} in file order
+    watch = {}
+    with open(csvWatchlistFile, 'r') as watchlist:
+        for row in csv.DictReader(watchlist):
+            if row['Status'] not in statusCodes:
+                raise ValueError('{0}: unknown status {1!r} for {2}'.format(
+                        csvWatchlistFile, row['Status'], row['Ticker']))
+            watch[sys.intern(row['Ticker'])] = statusCodes[row['Status']]
+    return watch
+
+
+def writeWatchlist(csvWatchlistFile, watch):
+    writeTable(csvWatchlistFile, watchlistHeader,
+               [[ticker, watchStatus[code]] for ticker, code in watch.items()])
+    return
+
+
+def watchedWith(watch, *statuses):
+    # The set of tickers whose status is any of the given codes
+    wanted = frozenset(statuses)
+    return set(ticker for ticker, code in watch.items() if code in wanted)